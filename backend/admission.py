@@ -0,0 +1,254 @@
+"""Admission control for /chat and /ingest: priority queueing, rate limits, coalescing.
+
+- A gate bounds how many chats and ingests run at once. Requests over the limit
+  wait in a per-kind queue; chats are always admitted before queued ingests, and
+  ingests have their own, smaller, concurrency cap so crawls cannot fill the gate.
+- A full queue, or a wait longer than RAG_QUEUE_TIMEOUT, is rejected at once with
+  503 and a Retry-After estimated from recent service times.
+- Each chat session gets a token bucket; an empty bucket is a 429.
+- Identical questions in flight at the same time (same normalized message, same
+  retrieved documents) share one LLM call.
+
+The gate works from threads (Flask) and from an asyncio loop (asgi.py) alike.
+"""
+import os, math, time, asyncio, hashlib, threading
+from collections import deque
+from metrics import Counter, Gauge, Histogram
+
+# requests running at once, over both kinds
+MAX_INFLIGHT = int(os.environ.get('RAG_MAX_INFLIGHT', 32))
+# crawls running at once, out of MAX_INFLIGHT
+MAX_INGESTS = int(os.environ.get('RAG_MAX_INGESTS', 2))
+CHAT_QUEUE = int(os.environ.get('RAG_CHAT_QUEUE', 64))
+INGEST_QUEUE = int(os.environ.get('RAG_INGEST_QUEUE', 4))
+# seconds a request may wait for a slot before it is shed
+QUEUE_TIMEOUT = float(os.environ.get('RAG_QUEUE_TIMEOUT', 30))
+# chats per minute per session, and how many may arrive back to back
+SESSION_RATE = float(os.environ.get('RAG_SESSION_RATE', 30))
+SESSION_BURST = int(os.environ.get('RAG_SESSION_BURST', 10))
+# sessions tracked before idle buckets are forgotten
+MAX_SESSIONS = 10000
+
+# admitted first, in this order
+PRIORITY = ('chat', 'ingest')
+
+REJECTED = Counter('rag_admission_rejected_total', 'Requests shed by admission control.', ['kind', 'reason'])
+QUEUE_DEPTH = Gauge('rag_admission_queue_depth', 'Requests waiting for a slot.', ['kind'])
+INFLIGHT = Gauge('rag_admission_inflight', 'Requests holding a slot.', ['kind'])
+QUEUE_SECONDS = Histogram('rag_admission_wait_seconds', 'Time spent waiting for a slot.', ['kind'])
+COALESCED = Counter('rag_chat_coalesced_total', 'Chats answered by an identical in-flight LLM call.')
+
+class Rejected(Exception):
+    """Raised instead of admitting a request; status is 429 or 503."""
+
+    def __init__(self, status, reason, retry_after):
+        super().__init__(reason)
+        self.status = status
+        self.reason = reason
+        self.retry_after = max(1, int(math.ceil(retry_after)))
+
+class _Waiter:
+    def __init__(self, wake):
+        self.wake = wake
+        self.granted = False
+        self.cancelled = False
+
+class Gate:
+    """Counting semaphore with per-kind limits, bounded queues and strict priority."""
+
+    def __init__(self, slots, limits, queue_limits):
+        self.slots = slots
+        self.limits = limits
+        self.queue_limits = queue_limits
+        self._lock = threading.Lock()
+        self._running = {kind: 0 for kind in PRIORITY}
+        self._queues = {kind: deque() for kind in PRIORITY}
+        # moving average of how long each kind holds a slot, for Retry-After
+        self._service = {kind: 1.0 for kind in PRIORITY}
+
+    def _fits(self, kind):
+        return sum(self._running.values()) < self.slots and self._running[kind] < self.limits[kind]
+
+    def _grant(self, kind):
+        self._running[kind] += 1
+        INFLIGHT.set(self._running[kind], kind=kind)
+
+    def _admit_waiting(self):
+        # called with the lock held; chats drain first, so ingests only get leftover slots
+        for kind in PRIORITY:
+            queue = self._queues[kind]
+            while queue and self._fits(kind):
+                waiter = queue.popleft()
+                if waiter.cancelled:
+                    continue
+                self._grant(kind)
+                waiter.granted = True
+                waiter.wake()
+            QUEUE_DEPTH.set(len(queue), kind=kind)
+
+    def retry_after(self, kind):
+        """Seconds until a request of this kind queued now would likely start."""
+        ahead = len(self._queues[kind]) + 1
+        if kind != 'chat':
+            ahead += len(self._queues['chat'])
+        return self._service[kind] * ahead / max(1, self.limits[kind])
+
+    def _enqueue(self, kind, wake):
+        """Admit at once (None), or queue a waiter; raises Rejected if the queue is full."""
+        with self._lock:
+            higher_waiting = any(self._queues[k] for k in PRIORITY[:PRIORITY.index(kind)])
+            if not self._queues[kind] and not higher_waiting and self._fits(kind):
+                self._grant(kind)
+                return None
+            if len(self._queues[kind]) >= self.queue_limits[kind]:
+                REJECTED.inc(kind=kind, reason='queue_full')
+                raise Rejected(503, f'{kind} queue is full', self.retry_after(kind))
+            waiter = _Waiter(wake)
+            self._queues[kind].append(waiter)
+            QUEUE_DEPTH.set(len(self._queues[kind]), kind=kind)
+            return waiter
+
+    def _give_up(self, kind, waiter):
+        """A waiter timed out; returns True if it got the slot in the meantime."""
+        with self._lock:
+            if waiter.granted:
+                return True
+            waiter.cancelled = True
+            self._queues[kind].remove(waiter)
+            QUEUE_DEPTH.set(len(self._queues[kind]), kind=kind)
+        REJECTED.inc(kind=kind, reason='queue_timeout')
+        raise Rejected(503, f'timed out waiting for a {kind} slot', self.retry_after(kind))
+
+    def acquire(self, kind, timeout=None):
+        """Block the calling thread until a slot is free."""
+        start = time.perf_counter()
+        event = threading.Event()
+        waiter = self._enqueue(kind, event.set)
+        if waiter is not None and not event.wait(QUEUE_TIMEOUT if timeout is None else timeout):
+            self._give_up(kind, waiter)
+        QUEUE_SECONDS.observe(time.perf_counter() - start, kind=kind)
+
+    async def acquire_async(self, kind, timeout=None):
+        """acquire() for coroutines: waits on the event loop, not a thread."""
+        start = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        event = asyncio.Event()
+        # slots can be released from worker threads, so wake the loop thread-safely
+        waiter = self._enqueue(kind, lambda: loop.call_soon_threadsafe(event.set))
+        if waiter is not None:
+            try:
+                await asyncio.wait_for(event.wait(), QUEUE_TIMEOUT if timeout is None else timeout)
+            except asyncio.TimeoutError:
+                self._give_up(kind, waiter)
+        QUEUE_SECONDS.observe(time.perf_counter() - start, kind=kind)
+
+    def release(self, kind, held_seconds=None):
+        with self._lock:
+            self._running[kind] -= 1
+            INFLIGHT.set(self._running[kind], kind=kind)
+            if held_seconds is not None:
+                self._service[kind] = 0.8 * self._service[kind] + 0.2 * held_seconds
+            self._admit_waiting()
+
+gate = Gate(MAX_INFLIGHT,
+            limits={'chat': MAX_INFLIGHT, 'ingest': MAX_INGESTS},
+            queue_limits={'chat': CHAT_QUEUE, 'ingest': INGEST_QUEUE})
+
+class RateLimiter:
+    """Token bucket per key: `rate` tokens per minute, holding at most `burst`."""
+
+    def __init__(self, rate, burst):
+        self.rate = rate / 60.0
+        self.burst = burst
+        self._lock = threading.Lock()
+        self._buckets = {}
+
+    def check(self, key):
+        """Take a token for key, or raise Rejected (429) with the wait until the next one."""
+        if self.rate <= 0:
+            return
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now)
+                REJECTED.inc(kind='chat', reason='rate_limited')
+                raise Rejected(429, 'too many requests for this session', (1 - tokens) / self.rate)
+            self._buckets[key] = (tokens - 1, now)
+            if len(self._buckets) > MAX_SESSIONS:
+                self._forget_idle(now)
+
+    def _forget_idle(self, now):
+        # a bucket that has refilled is the same as no bucket
+        full = [k for k, (tokens, last) in self._buckets.items()
+                if tokens + (now - last) * self.rate >= self.burst]
+        for k in full:
+            del self._buckets[k]
+
+session_limiter = RateLimiter(SESSION_RATE, SESSION_BURST)
+
+def coalesce_key(message, hits):
+    normalized = ' '.join(message.lower().split())
+    key = normalized + '\0' + '\0'.join(h['url'] for h in hits)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+class SingleFlight:
+    """Run fn once per key among concurrent callers; the others get its result."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn, *args):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = {'done': threading.Event(), 'result': None, 'error': None}
+        if not leader:
+            COALESCED.inc()
+            call['done'].wait()
+            if call['error'] is not None:
+                raise call['error']
+            return call['result']
+        try:
+            call['result'] = fn(*args)
+            return call['result']
+        except Exception as e:
+            call['error'] = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call['done'].set()
+
+class AsyncSingleFlight:
+    """SingleFlight for coroutines on one event loop."""
+
+    def __init__(self):
+        self._calls = {}
+
+    async def do(self, key, coro_fn, *args):
+        future = self._calls.get(key)
+        if future is not None:
+            COALESCED.inc()
+            # shield: a cancelled follower must not cancel the leader's call
+            return await asyncio.shield(future)
+        future = self._calls[key] = asyncio.get_running_loop().create_future()
+        try:
+            result = await coro_fn(*args)
+            future.set_result(result)
+            return result
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            # retrieve it so an exception nobody waited for is not logged
+            future.exception()
+            raise
+        finally:
+            del self._calls[key]
+
+llm_calls = SingleFlight()
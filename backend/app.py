@@ -1,38 +1,202 @@
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g, Response, send_file
 from ingest import crawler_ingest
-from rag import init_store, add_document, chat_with_retrieval, get_stats, get_urls, delete_document, get_document_content, get_all_documents, delete_all_documents, delete_chat_session, delete_all_chat_sessions, get_all_chat_sessions
-import os
+import rag
+from rag import start_background_init, add_documents, chat_with_retrieval, resolve_collections, get_collections, delete_collection, rebuild_index, get_stats, get_urls, delete_document, get_document_content, get_all_documents, delete_all_documents, delete_chat_session, delete_all_chat_sessions, get_all_chat_sessions
+import metrics
+import admission
+import profiling
+import snapshot
+import os, time, tempfile, functools
 
 app = Flask(__name__)
-DB_PATH = os.path.join(os.path.dirname(__file__), 'rag_store.db')
+DB_PATH = os.environ.get('RAG_DB_PATH') or os.path.join(os.path.dirname(__file__), 'rag_store.db')
+# Pause between crawler requests in seconds
+CRAWL_DELAY = float(os.environ.get('RAG_CRAWL_DELAY', 0.2))
+# Adds Server-Timing / X-Response-Time headers with a per-stage breakdown
+DEBUG_TIMING = os.environ.get('RAG_DEBUG_TIMING', '').lower() in ('1', 'true', 'yes')
 
-# Initialize (loads embeddings and vector index if present)
-init_store(DB_PATH)
+# Routes that need the embedding model or change the vector index; they wait for the startup
+# load, which would otherwise replace partitions they rebuilt or dropped. The rest only read SQLite.
+MODEL_ROUTES = {'/ingest', '/chat', '/reindex', '/snapshot/import', '/delete', '/delete_all', '/delete_collection'}
 
-@app.route('/ingest', methods=['POST'])
-def ingest():
-    data = request.json
+import rerank
+if rerank.RERANK_ENABLED:
+    rerank.load_reranker(block=False)
+
+# Create tables now; the embedding model and vector index load in the background so the
+# server can bind immediately. MODEL_ROUTES answer 503 until rag.ready is set.
+start_background_init(DB_PATH)
+
+def timing_enabled():
+    return DEBUG_TIMING or app.debug
+
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+    if timing_enabled():
+        metrics.start_request_timing()
+
+@app.before_request
+def readiness_gate():
+    if request.url_rule is not None and request.url_rule.rule in MODEL_ROUTES and not rag.ready.is_set():
+        resp = jsonify({'error': 'model loading, try again shortly'})
+        resp.headers['Retry-After'] = '5'
+        return resp, 503
+
+@app.before_request
+def start_profile():
+    # profiling off costs this one check per request
+    if profiling.active is not None and request.url_rule is not None:
+        session = profiling.active
+        handle = session.begin(request.url_rule.rule)
+        if handle is not None:
+            g.profile = (session, handle)
+
+@app.teardown_request
+def finish_profile(exc):
+    profile = g.pop('profile', None)
+    if profile is not None:
+        session, handle = profile
+        session.end(handle)
+
+@app.route('/health', methods=['GET'])
+def health():
+    return jsonify({'status': 'ok'})
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    if rag.ready.is_set():
+        return jsonify({'ready': True})
+    body = {'ready': False}
+    if rag.init_error is not None:
+        body['error'] = str(rag.init_error)
+    return jsonify(body), 503
+
+@app.after_request
+def record_timing(response):
+    start = g.pop('request_start', None)
+    if start is None:
+        return response
+    elapsed = time.perf_counter() - start
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.HTTP_REQUEST_SECONDS.observe(elapsed, route=route, status=response.status_code)
+    if timing_enabled():
+        timings = metrics.finish_request_timing()
+        response.headers['Server-Timing'] = metrics.server_timing_header(timings, total=elapsed)
+        response.headers['X-Response-Time'] = f'{elapsed * 1000:.1f}ms'
+    return response
+
+def rejected(e):
+    resp = jsonify({'error': e.reason})
+    resp.headers['Retry-After'] = str(e.retry_after)
+    return resp, e.status
+
+def admitted(kind):
+    """Run a view under admission control: shed with 429/503 and Retry-After instead of queueing without bound."""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            try:
+                if kind == 'chat':
+                    admission.session_limiter.check((request.get_json(silent=True) or {}).get('session_id', 'default'))
+                admission.gate.acquire(kind)
+            except admission.Rejected as e:
+                return rejected(e)
+            start = time.perf_counter()
+            try:
+                return view(*args, **kwargs)
+            finally:
+                admission.gate.release(kind, time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/admin/profile', methods=['GET', 'POST', 'DELETE'])
+def admin_profile():
+    """POST starts a profiling session, GET reports on it (?format=text for the raw output), DELETE stops it."""
+    if not profiling.ADMIN_TOKEN:
+        return jsonify({'error': 'not found'}), 404
+    if not profiling.authorized(request.headers.get('X-Admin-Token')):
+        return jsonify({'error': 'forbidden'}), 403
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        try:
+            session = profiling.start(mode=data.get('mode', 'cprofile'), routes=data.get('routes'),
+                                      requests=data.get('requests'), seconds=data.get('seconds'),
+                                      trace_allocations=data.get('tracemalloc', False),
+                                      interval_ms=data.get('interval_ms', profiling.DEFAULT_INTERVAL_MS))
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        except RuntimeError as e:
+            return jsonify({'error': str(e)}), 409
+        return jsonify(session.report()), 202
+    session = profiling.stop() if request.method == 'DELETE' else profiling.current()
+    if session is None:
+        return jsonify({'error': 'no profiling session'}), 404
+    if request.args.get('format') == 'text':
+        return Response(session.output(), mimetype='text/plain')
+    return jsonify(dict(session.report(), output=session.output()))
+
+def run_ingest(data):
+    """Crawl and store for an /ingest body; returns (response body, status). Shared with asgi.py."""
     url = data.get('url')
     max_pages = int(data.get('max_pages', 50))
     depth = int(data.get('depth', 2))
     if not url:
-        return jsonify({'error': 'url required'}), 400
-    docs = crawler_ingest(url, max_pages=max_pages, max_depth=depth)
-    added = 0
-    for d in docs:
-        add_document(DB_PATH, d['url'], d['text'])
-        added += 1
-    return jsonify({'ingested': added, 'base_url': url})
+        return {'error': 'url required'}, 400
+    # every page of a crawl lands in one collection, named after the start URL's domain by default
+    collection = data.get('collection') or rag.collection_for_url(url)
+    docs = crawler_ingest(url, max_pages=max_pages, max_depth=depth, delay=CRAWL_DELAY)
+    result = add_documents(DB_PATH, docs, collection=collection)
+    boilerplate_bytes = sum(d['raw_bytes'] - len(d['text'].encode('utf-8')) for d in docs)
+    return {
+        'ingested': result['added'],
+        'base_url': url,
+        'collection': collection,
+        'crawled': len(docs),
+        'boilerplate_bytes_removed': boilerplate_bytes,
+        'duplicates_skipped': result['duplicates_skipped'],
+        # what was kept out of the store and the prompts, and embeddings not computed
+        'bytes_avoided': boilerplate_bytes + result['duplicate_bytes_skipped'],
+        'embeddings_avoided': result['duplicates_skipped'],
+    }, 200
 
-@app.route('/chat', methods=['POST'])
-def chat():
-    data = request.json
-    session_id = data.get('session_id', 'default')
+def parse_chat(data):
+    """Validate a /chat body; returns (chat params, error message). Shared with asgi.py."""
     message = data.get('message')
-    top_k = int(data.get('top_k', 4))
     if not message:
-        return jsonify({'error': 'message required'}), 400
-    resp = chat_with_retrieval(DB_PATH, session_id, message, top_k=top_k)
+        return None, 'message required'
+    # rerank: over-fetch candidates and keep the top_k best by cross-encoder (default: RAG_RERANK)
+    use_rerank = data.get('rerank')
+    try:
+        # optional filter: a collection name (or list), or a domain (or list) of ingested sites
+        collections = resolve_collections(data.get('collection'), data.get('domain'))
+    except ValueError as e:
+        return None, str(e)
+    return {
+        'session_id': data.get('session_id', 'default'),
+        'message': message,
+        'top_k': int(data.get('top_k', 4)),
+        'collections': collections,
+        'use_rerank': None if use_rerank is None else bool(use_rerank),
+    }, None
+
+@app.route('/ingest', methods=['POST'])
+@admitted('ingest')
+def ingest():
+    body, status = run_ingest(request.json)
+    return jsonify(body), status
+
+@app.route('/chat', methods=['POST'])
+@admitted('chat')
+def chat():
+    params, error = parse_chat(request.json)
+    if error:
+        return jsonify({'error': error}), 400
+    resp = chat_with_retrieval(DB_PATH, **params)
     return jsonify(resp)
 
 @app.route('/stats', methods=['GET'])
@@ -68,6 +232,55 @@ def delete_all():
     deleted_count = delete_all_documents(DB_PATH)
     return jsonify({'success': True, 'deleted_count': deleted_count})
 
+@app.route('/collections', methods=['GET'])
+def collections():
+    return jsonify(get_collections(DB_PATH))
+
+@app.route('/delete_collection', methods=['POST'])
+def delete_collection_endpoint():
+    data = request.json
+    collection = data.get('collection')
+    if not collection:
+        return jsonify({'error': 'collection required'}), 400
+    if not isinstance(collection, str):
+        return jsonify({'error': 'collection must be a name'}), 400
+    deleted_count = delete_collection(DB_PATH, collection)
+    return jsonify({'success': True, 'deleted_count': deleted_count})
+
+@app.route('/reindex', methods=['POST'])
+def reindex():
+    data = request.json or {}
+    collection = data.get('collection')
+    if collection is not None and not isinstance(collection, str):
+        return jsonify({'error': 'collection must be a name'}), 400
+    rebuild_index(DB_PATH, collection)
+    return jsonify({'success': True, 'collection': collection})
+
+@app.route('/snapshot/export', methods=['GET'])
+def snapshot_export():
+    dtype = request.args.get('dtype', 'float16')
+    if dtype not in snapshot.DTYPES:
+        return jsonify({'error': f'dtype must be one of {list(snapshot.DTYPES)}'}), 400
+    fd, path = tempfile.mkstemp(prefix='rag-export-', suffix='.ragsnap')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            snapshot.export_snapshot(DB_PATH, f, dtype=dtype)
+    except snapshot.SnapshotError as e:
+        os.remove(path)
+        return jsonify({'error': str(e)}), 409
+    resp = send_file(path, mimetype='application/x-tar', as_attachment=True, download_name='rag_store.ragsnap')
+    resp.call_on_close(lambda: os.remove(path))
+    return resp
+
+@app.route('/snapshot/import', methods=['POST'])
+def snapshot_import():
+    # raw snapshot bytes as the request body, read as a stream
+    try:
+        result = snapshot.import_snapshot(DB_PATH, request.stream)
+    except snapshot.SnapshotError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify(dict(result, success=True))
+
 @app.route('/delete_chat_session', methods=['POST'])
 def delete_chat_session_endpoint():
     data = request.json
@@ -0,0 +1,158 @@
+"""Async serving mode for the backend (same JSON API as app.py).
+
+/chat and /ingest are native async handlers: the Groq call goes through a pooled
+httpx.AsyncClient, so a waiting chat holds no thread, while embedding, search and
+SQLite work run on a bounded thread pool. Every other route is the Flask app,
+mounted as WSGI.
+
+    uvicorn asgi:app --port 8000
+"""
+import os, time, asyncio, functools, contextvars
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse
+from starlette.routing import Route, Mount
+
+import app as flask_backend
+import rag
+import admission
+import metrics
+from metrics import timed, LLM_REQUESTS, LLM_FALLBACKS, HTTP_REQUEST_SECONDS
+
+DB_PATH = flask_backend.DB_PATH
+# threads for embedding, vector search and SQLite; the CPU-bound part of a chat
+CPU_WORKERS = int(os.environ.get('RAG_CPU_WORKERS', os.cpu_count() or 4))
+# concurrent crawls; each one blocks a thread for its whole duration
+INGEST_WORKERS = int(os.environ.get('RAG_INGEST_WORKERS', 2))
+# pooled connections to the LLM provider, shared by all in-flight chats
+LLM_MAX_CONNECTIONS = int(os.environ.get('RAG_LLM_MAX_CONNECTIONS', 100))
+LLM_TIMEOUT = float(os.environ.get('RAG_LLM_TIMEOUT', 60))
+
+cpu_pool = ThreadPoolExecutor(max_workers=CPU_WORKERS, thread_name_prefix='rag-cpu')
+ingest_pool = ThreadPoolExecutor(max_workers=INGEST_WORKERS, thread_name_prefix='rag-ingest')
+# fallback providers (Hugging Face, local model) are blocking; keep them off the CPU pool
+fallback_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix='rag-llm-fallback')
+http_client = None
+llm_calls = admission.AsyncSingleFlight()
+
+async def run_in(pool, fn, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    # run_in_executor does not carry contextvars; the copy shares the request's stage timings
+    ctx = contextvars.copy_context()
+    return await loop.run_in_executor(pool, lambda: ctx.run(fn, *args, **kwargs))
+
+async def call_completion(system_message, user_message):
+    """Async counterpart of rag.call_completion: Groq over the pooled client, then the fallbacks."""
+    groq_key = os.environ.get('GROQ_API_KEY')
+    if groq_key:
+        base_url = os.environ.get('GROQ_BASE_URL', 'https://api.groq.com').rstrip('/')
+        try:
+            r = await http_client.post(f'{base_url}/openai/v1/chat/completions',
+                                       headers={'Authorization': f'Bearer {groq_key}'},
+                                       json=rag.groq_payload(system_message, user_message))
+            r.raise_for_status()
+            LLM_REQUESTS.inc(provider='groq')
+            return r.json()['choices'][0]['message']['content'].strip()
+        except Exception as e:
+            print('Groq completion failed, falling back:', e)
+            LLM_FALLBACKS.inc(provider='groq')
+    return await run_in(fallback_pool, rag.fallback_completion, system_message, user_message)
+
+def rejected(e):
+    return JSONResponse({'error': e.reason}, status_code=e.status, headers={'Retry-After': str(e.retry_after)})
+
+def not_ready():
+    return JSONResponse({'error': 'model loading, try again shortly'}, status_code=503, headers={'Retry-After': '5'})
+
+async def read_json(request):
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+def observed(handler):
+    """Record the request in rag_http_request_seconds and add the debug timing headers, as app.py does for Flask routes."""
+    @functools.wraps(handler)
+    async def wrapper(request):
+        start = time.perf_counter()
+        timing = flask_backend.timing_enabled()
+        if timing:
+            metrics.start_request_timing()
+        # an exception becomes a 500 from Starlette
+        status = 500
+        try:
+            response = await handler(request)
+            status = response.status_code
+        finally:
+            elapsed = time.perf_counter() - start
+            HTTP_REQUEST_SECONDS.observe(elapsed, route=request.url.path, status=status)
+            timings = metrics.finish_request_timing() if timing else None
+        if timing:
+            response.headers['Server-Timing'] = metrics.server_timing_header(timings, total=elapsed)
+            response.headers['X-Response-Time'] = f'{elapsed * 1000:.1f}ms'
+        return response
+    return wrapper
+
+@observed
+async def chat(request):
+    if not rag.ready.is_set():
+        return not_ready()
+    params, error = flask_backend.parse_chat(await read_json(request) or {})
+    if error:
+        return JSONResponse({'error': error}, status_code=400)
+    session_id, message = params['session_id'], params['message']
+    try:
+        admission.session_limiter.check(session_id)
+        await admission.gate.acquire_async('chat')
+    except admission.Rejected as e:
+        return rejected(e)
+    start = time.perf_counter()
+    try:
+        await run_in(cpu_pool, rag.save_chat, DB_PATH, session_id, 'user', message)
+        hits = await run_in(cpu_pool, rag.retrieve_for_chat, DB_PATH, message, top_k=params['top_k'],
+                            collections=params['collections'], use_rerank=params['use_rerank'])
+        system_message, user_message = rag.build_prompt(message, hits)
+        with timed('llm'):
+            answer = await llm_calls.do(admission.coalesce_key(message, hits), call_completion, system_message, user_message)
+        await run_in(cpu_pool, rag.save_chat, DB_PATH, session_id, 'assistant', answer)
+    finally:
+        admission.gate.release('chat', time.perf_counter() - start)
+    return JSONResponse({'answer': answer, 'sources': [h['url'] for h in hits]})
+
+@observed
+async def ingest(request):
+    if not rag.ready.is_set():
+        return not_ready()
+    try:
+        await admission.gate.acquire_async('ingest')
+    except admission.Rejected as e:
+        return rejected(e)
+    start = time.perf_counter()
+    try:
+        body, status = await run_in(ingest_pool, flask_backend.run_ingest, await read_json(request) or {})
+    finally:
+        admission.gate.release('ingest', time.perf_counter() - start)
+    return JSONResponse(body, status_code=status)
+
+@asynccontextmanager
+async def lifespan(app):
+    global http_client
+    limits = httpx.Limits(max_connections=LLM_MAX_CONNECTIONS, max_keepalive_connections=LLM_MAX_CONNECTIONS)
+    http_client = httpx.AsyncClient(limits=limits, timeout=LLM_TIMEOUT)
+    try:
+        yield
+    finally:
+        await http_client.aclose()
+
+app = Starlette(
+    routes=[
+        Route('/chat', chat, methods=['POST']),
+        Route('/ingest', ingest, methods=['POST']),
+        Mount('/', app=WSGIMiddleware(flask_backend.app)),
+    ],
+    lifespan=lifespan,
+)
@@ -0,0 +1,284 @@
+"""Offline bulk loading from URL lists, directories of saved HTML and WARC files.
+
+Pages are fetched and parsed on a process pool while the previous batch is being
+embedded, each batch is stored in one transaction, and index partitions are
+rebuilt once at the end instead of after every batch. A checkpoint file records
+how far each source got, so an interrupted run picks up where it stopped.
+
+    python bulk_ingest.py --urls urls.txt
+    python bulk_ingest.py --html-dir dump/ --base-url https://docs.example.com/
+    python bulk_ingest.py --warc crawl.warc.gz --collection archive
+"""
+import os, sys, json, gzip, time, zlib, argparse, contextlib
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from urllib.parse import urljoin
+
+import requests
+from bs4 import BeautifulSoup
+
+import rag
+import dedup
+from ingest import page_blocks
+
+HTML_SUFFIXES = ('.html', '.htm', '.xhtml')
+
+# Readers yield (url, html) records, skipping the first `start` (loaded by an earlier
+# run) without reading their content.
+
+def _url_list(path, base_url=None, start=0):
+    with open(path, encoding='utf-8') as f:
+        urls = (line.strip() for line in f)
+        for i, url in enumerate(u for u in urls if u and not u.startswith('#')):
+            if i >= start:
+                # fetched by the parse workers
+                yield url, None
+
+def _html_dir(path, base_url=None, start=0):
+    root = Path(path).resolve()
+    files = sorted(p for p in root.rglob('*') if p.suffix.lower() in HTML_SUFFIXES and p.is_file())
+    for p in files[start:]:
+        if base_url:
+            url = urljoin(base_url.rstrip('/') + '/', p.relative_to(root).as_posix())
+        else:
+            url = p.as_uri()
+        yield url, p.read_bytes()
+
+def _dechunk(body):
+    out, pos = [], 0
+    while True:
+        end = body.find(b'\r\n', pos)
+        if end < 0:
+            break
+        size = int(body[pos:end].split(b';')[0] or b'0', 16)
+        if size == 0:
+            break
+        out.append(body[end + 2:end + 2 + size])
+        pos = end + 2 + size + 2
+    return b''.join(out)
+
+def _http_html(payload):
+    """HTML body of a raw HTTP response, or None if it is not an HTML response."""
+    head, _, body = payload.partition(b'\r\n\r\n')
+    headers = {}
+    for line in head.split(b'\r\n')[1:]:
+        k, _, v = line.decode('latin-1').partition(':')
+        headers[k.strip().lower()] = v.strip().lower()
+    if 'text/html' not in headers.get('content-type', ''):
+        return None
+    if 'chunked' in headers.get('transfer-encoding', ''):
+        body = _dechunk(body)
+    if headers.get('content-encoding') in ('gzip', 'deflate'):
+        try:
+            body = zlib.decompress(body, 16 + zlib.MAX_WBITS if headers['content-encoding'] == 'gzip' else zlib.MAX_WBITS)
+        except zlib.error:
+            return None
+    return body
+
+def _warc(path, base_url=None, start=0):
+    """HTML pages in a WARC file (plain or .gz): response records and text/html resource records."""
+    opener = gzip.open if path.endswith('.gz') else open
+    position = 0
+    with opener(path, 'rb') as f:
+        while True:
+            line = f.readline()
+            if not line:
+                return
+            if not line.strip():
+                continue
+            if not line.startswith(b'WARC/'):
+                raise ValueError(f'{path}: expected a WARC record header, got {line[:40]!r}')
+            headers = {}
+            while True:
+                line = f.readline()
+                if not line.strip():
+                    break
+                k, _, v = line.decode('utf-8', 'replace').partition(':')
+                headers[k.strip().lower()] = v.strip()
+            position += 1
+            if position <= start:
+                # loaded already: step over the payload instead of reading it
+                f.seek(int(headers.get('content-length', 0)), os.SEEK_CUR)
+                continue
+            payload = f.read(int(headers.get('content-length', 0)))
+            kind, url = headers.get('warc-type'), headers.get('warc-target-uri', '').strip('<>')
+            if kind == 'response' and 'application/http' in headers.get('content-type', ''):
+                html = _http_html(payload)
+            elif kind == 'resource' and 'text/html' in headers.get('content-type', ''):
+                html = payload
+            else:
+                html = None
+            # every record counts towards the checkpoint position, pages or not
+            yield url, html if html is not None else b''
+
+READERS = {'urls': _url_list, 'html_dir': _html_dir, 'warc': _warc}
+
+def parse_record(record):
+    """Runs in a worker process: (url, html bytes or None to fetch) -> {url, blocks, raw_bytes} or None."""
+    url, html = record
+    if not url:
+        return None
+    if html is None:
+        try:
+            r = requests.get(url, timeout=10, headers={'User-Agent': 'rag-bot/1.0'})
+        except Exception:
+            return None
+        if r.status_code != 200 or 'text/html' not in r.headers.get('Content-Type', ''):
+            return None
+        html = r.content
+    if not html:
+        return None
+    try:
+        blocks = page_blocks(BeautifulSoup(html, 'html.parser'))
+    except Exception:
+        return None
+    if not blocks:
+        return None
+    return {'url': url, 'blocks': blocks}
+
+def _records(sources, base_url, done):
+    """(source key, position, url, html) for every record not yet covered by the checkpoint."""
+    for kind, path in sources:
+        key = f'{kind}:{os.path.abspath(path)}'
+        start = done.get(key, 0)
+        for i, (url, html) in enumerate(READERS[kind](path, base_url, start), start):
+            yield key, i, url, html
+
+def _batches(records, size):
+    batch = []
+    for r in records:
+        batch.append(r)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _strip(pages, collection):
+    """Strip boilerplate per site within a batch; returns {url, text} docs."""
+    groups = {}
+    for p in pages:
+        groups.setdefault(collection or rag.collection_for_url(p['url']), []).append(p)
+    docs = []
+    for group in groups.values():
+        texts = dedup.strip_boilerplate([p['blocks'] for p in group])
+        docs.extend({'url': p['url'], 'text': text} for p, text in zip(group, texts))
+    return docs
+
+def load_checkpoint(path):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {'sources': {}, 'collections': [], 'stats': {}}
+
+def save_checkpoint(path, state):
+    # write-then-rename, so a crash mid-write leaves the previous checkpoint
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp, path)
+
+def bulk_ingest(db_path, sources, base_url=None, collection=None, workers=None, batch_size=2000,
+                embed_batch_size=256, checkpoint=None, strip_boilerplate=True, skip_near_duplicates=True,
+                log=print):
+    """Load every page of `sources` ([(kind, path)], kind in READERS) into the store.
+
+    Resumes from `checkpoint` if it exists and removes it once every source is done.
+    Returns counts and timings for the whole run, earlier interrupted runs included.
+    """
+    rag.init_db(db_path)
+    if rag.embedder is None:
+        rag.load_model()
+    checkpoint = checkpoint or db_path + '.bulk-checkpoint.json'
+    state = load_checkpoint(checkpoint)
+    stats = {'records': 0, 'pages': 0, 'added': 0, 'duplicates_skipped': 0, 'seconds': 0.0}
+    stats.update(state['stats'])
+    touched = set(state['collections'])
+    workers = workers or os.cpu_count() or 1
+    pool = ProcessPoolExecutor(max_workers=workers) if workers > 1 else None
+
+    def submit(batch):
+        if batch is None:
+            return None
+        items = [(url, html) for _, _, url, html in batch]
+        if pool is None:
+            return batch, map(parse_record, items)
+        return batch, pool.map(parse_record, items, chunksize=max(1, len(items) // (workers * 4)))
+
+    start = time.perf_counter()
+    run_start_seconds = stats['seconds']
+    batches = _batches(_records(sources, base_url, state['sources']), batch_size)
+    try:
+        pending = submit(next(batches, None))
+        while pending is not None:
+            batch, results = pending
+            pages = [p for p in results if p is not None]
+            # the pool parses the next batch while this one is embedded and stored
+            pending = submit(next(batches, None))
+            if strip_boilerplate:
+                docs = _strip(pages, collection)
+            else:
+                docs = [{'url': p['url'], 'text': ' '.join(p['blocks'])} for p in pages]
+            result = rag.add_documents(db_path, docs, collection=collection, skip_near_duplicates=skip_near_duplicates,
+                                       update_index=False, embed_batch_size=embed_batch_size)
+            touched.update(result['collections'])
+            for key, position, _, _ in batch:
+                state['sources'][key] = position + 1
+            stats['records'] += len(batch)
+            stats['pages'] += len(pages)
+            stats['added'] += result['added']
+            stats['duplicates_skipped'] += result['duplicates_skipped']
+            stats['seconds'] = run_start_seconds + time.perf_counter() - start
+            state['collections'] = sorted(touched)
+            state['stats'] = stats
+            save_checkpoint(checkpoint, state)
+            log(f"{stats['pages']} pages ({stats['added']} added, {stats['duplicates_skipped']} near-duplicates), "
+                f"{stats['pages'] / stats['seconds']:.1f} pages/s")
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+    index_start = time.perf_counter()
+    for name in sorted(touched):
+        rag.rebuild_index(db_path, name)
+    stats['index_seconds'] = time.perf_counter() - index_start
+    stats['seconds'] = run_start_seconds + time.perf_counter() - start
+    stats['pages_per_second'] = stats['pages'] / stats['seconds'] if stats['seconds'] else None
+    stats['collections'] = len(touched)
+    # only written after a batch, so a run with no records has none
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(checkpoint)
+    return stats
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--db', default=os.environ.get('RAG_DB_PATH') or os.path.join(os.path.dirname(__file__), 'rag_store.db'))
+    parser.add_argument('--urls', action='append', default=[], help='file with one URL per line')
+    parser.add_argument('--html-dir', action='append', default=[], help='directory of saved .html files')
+    parser.add_argument('--warc', action='append', default=[], help='WARC file (.warc or .warc.gz)')
+    parser.add_argument('--base-url', help='URL that --html-dir paths are relative to (default: file:// URLs)')
+    parser.add_argument('--collection', help="collection for every page (default: each URL's domain)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help='parse processes (1 parses inline)')
+    parser.add_argument('--batch-size', type=int, default=2000, help='pages per transaction and checkpoint')
+    parser.add_argument('--embed-batch-size', type=int, default=256)
+    parser.add_argument('--checkpoint', help='checkpoint file (default: <db>.bulk-checkpoint.json)')
+    parser.add_argument('--restart', action='store_true', help='ignore an existing checkpoint')
+    parser.add_argument('--keep-boilerplate', action='store_true')
+    parser.add_argument('--keep-near-duplicates', action='store_true')
+    args = parser.parse_args(argv)
+    sources = [('urls', p) for p in args.urls] + [('html_dir', p) for p in args.html_dir] + [('warc', p) for p in args.warc]
+    if not sources:
+        parser.error('give at least one of --urls, --html-dir, --warc')
+    checkpoint = args.checkpoint or args.db + '.bulk-checkpoint.json'
+    if args.restart and os.path.exists(checkpoint):
+        os.remove(checkpoint)
+    elif os.path.exists(checkpoint):
+        print(f'Resuming from {checkpoint}', file=sys.stderr)
+    result = bulk_ingest(args.db, sources, base_url=args.base_url, collection=args.collection, workers=args.workers,
+                         batch_size=args.batch_size, embed_batch_size=args.embed_batch_size, checkpoint=checkpoint,
+                         strip_boilerplate=not args.keep_boilerplate, skip_near_duplicates=not args.keep_near_duplicates,
+                         log=lambda line: print(line, file=sys.stderr))
+    print(json.dumps(result))
+
+if __name__ == '__main__':
+    main()
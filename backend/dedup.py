@@ -0,0 +1,144 @@
+"""Boilerplate stripping and near-duplicate detection for crawled pages.
+
+Boilerplate: a page is split into text blocks, and a block whose normalized form
+shows up on a large share of a crawl's pages (menus, footers, cookie banners) is
+dropped from every page.
+
+Near-duplicates: each page gets a 64-bit SimHash over word shingles; pages within
+a small Hamming distance of an already stored page are not embedded again. A
+SimHashIndex finds them through exact band matches instead of comparing a page with
+every stored fingerprint.
+"""
+import re, hashlib
+import numpy as np
+
+SHINGLE_WORDS = 3
+# SimHashes this many bits apart or fewer are near-duplicates; unrelated pages sit
+# around 32 bits apart, a page differing by a heading or a few links at 1-6
+MAX_HAMMING = 6
+# SimHashes are split into this many bit bands for lookup: two within MAX_HAMMING bits
+# differ in at most MAX_HAMMING bands, so they agree exactly on at least one
+BANDS = MAX_HAMMING + 1
+# a block is boilerplate when it appears on at least this share of a crawl's pages...
+BOILERPLATE_RATIO = 0.5
+# ...and on at least this many pages, so small crawls keep their text
+BOILERPLATE_MIN_PAGES = 3
+
+_WORD_RE = re.compile(r'\w+')
+
+def _block_key(block):
+    normalized = ' '.join(block.lower().split())
+    return hashlib.blake2b(normalized.encode('utf-8'), digest_size=8).digest()
+
+def strip_boilerplate(pages, ratio=BOILERPLATE_RATIO, min_pages=BOILERPLATE_MIN_PAGES):
+    """Drop blocks repeated across pages.
+
+    pages is a list of block lists (one list of text blocks per page); returns the
+    list of texts with boilerplate removed. A page made only of boilerplate keeps
+    its full text, leaving it to near-duplicate detection.
+    """
+    keys = [[_block_key(b) for b in blocks] for blocks in pages]
+    counts = {}
+    for page_keys in keys:
+        for k in set(page_keys):
+            counts[k] = counts.get(k, 0) + 1
+    threshold = max(min_pages, ratio * len(pages))
+    texts = []
+    for blocks, page_keys in zip(pages, keys):
+        kept = [b for b, k in zip(blocks, page_keys) if counts[k] < threshold]
+        texts.append(' '.join(kept or blocks))
+    return texts
+
+def _shingle_hashes(text):
+    words = _WORD_RE.findall(text.lower())
+    if len(words) < SHINGLE_WORDS:
+        shingles = [' '.join(words)]
+    else:
+        shingles = [' '.join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)]
+    return np.array([int.from_bytes(hashlib.blake2b(s.encode('utf-8'), digest_size=8).digest(), 'little')
+                     for s in shingles], dtype='uint64')
+
+def simhash(text):
+    """64-bit SimHash of a text as a signed int (fits an SQLite INTEGER)."""
+    hashes = _shingle_hashes(text)
+    bits = np.unpackbits(hashes.view('uint8').reshape(-1, 8), axis=1, bitorder='little')
+    votes = bits.astype('int32').sum(axis=0) * 2 - len(hashes)
+    fingerprint = np.packbits(votes > 0, bitorder='little').view('uint64')[0]
+    return int(fingerprint.view('int64'))
+
+def hamming_distances(fingerprint, others):
+    """Bit distance between one SimHash and an array of SimHashes."""
+    if len(others) == 0:
+        return np.zeros(0, dtype='int64')
+    x = np.bitwise_xor(np.asarray(others, dtype='int64'), np.int64(fingerprint))
+    return np.unpackbits(x.view('uint8').reshape(-1, 8), axis=1).sum(axis=1)
+
+def is_near_duplicate(fingerprint, others, max_distance=MAX_HAMMING):
+    return bool(len(others)) and int(hamming_distances(fingerprint, others).min()) <= max_distance
+
+def _band_edges(bands):
+    return [64 * i // bands for i in range(bands + 1)]
+
+class SimHashIndex:
+    """Near-duplicate lookup over many SimHashes.
+
+    Fingerprints are bucketed by each of BANDS bit ranges; only fingerprints sharing
+    a band with the query are compared bit by bit. The initial fingerprints are kept
+    as sorted band arrays (built in numpy), later ones in per-band dicts.
+    """
+
+    def __init__(self, fingerprints=(), max_distance=MAX_HAMMING):
+        self.max_distance = max_distance
+        edges = _band_edges(max_distance + 1)
+        self._bands = [(lo, (1 << (hi - lo)) - 1) for lo, hi in zip(edges, edges[1:])]
+        initial = np.asarray(fingerprints, dtype='int64')
+        self._size = len(initial)
+        self._hashes = np.empty(max(64, 2 * self._size), dtype='int64')
+        self._hashes[:self._size] = initial
+        unsigned = initial.view('uint64')
+        self._sorted = []
+        for lo, mask in self._bands:
+            # int64, so lookups with Python ints don't cast the whole array
+            keys = ((unsigned >> np.uint64(lo)) & np.uint64(mask)).astype('int64')
+            order = np.argsort(keys, kind='stable')
+            self._sorted.append((keys[order], order))
+        self._added = [{} for _ in self._bands]
+
+    def __len__(self):
+        return self._size
+
+    def _keys(self, fingerprint):
+        unsigned = fingerprint & 0xFFFFFFFFFFFFFFFF
+        return [(unsigned >> lo) & mask for lo, mask in self._bands]
+
+    def add(self, fingerprint):
+        """Add a fingerprint; returns its position."""
+        if self._size == len(self._hashes):
+            grown = np.empty(2 * len(self._hashes), dtype='int64')
+            grown[:self._size] = self._hashes[:self._size]
+            self._hashes = grown
+        position = self._size
+        self._hashes[position] = fingerprint
+        self._size += 1
+        for table, key in zip(self._added, self._keys(fingerprint)):
+            table.setdefault(key, []).append(position)
+        return position
+
+    def candidates(self, fingerprint):
+        """Positions of fingerprints sharing at least one band with this one (may repeat)."""
+        found = []
+        for (keys, order), table, key in zip(self._sorted, self._added, self._keys(fingerprint)):
+            lo, hi = np.searchsorted(keys, [key, key + 1])
+            found.append(order[lo:hi])
+            if key in table:
+                found.append(np.asarray(table[key], dtype='int64'))
+        return np.concatenate(found)
+
+    def find(self, fingerprint, exclude=None):
+        """True if a fingerprint other than position `exclude` is within max_distance bits."""
+        found = self.candidates(fingerprint)
+        if exclude is not None:
+            found = found[found != exclude]
+        if not len(found):
+            return False
+        return int(hamming_distances(fingerprint, self._hashes[found]).min()) <= self.max_distance
@@ -3,6 +3,8 @@ from bs4 import BeautifulSoup
 from urllib.parse import urlparse, urljoin
 from collections import deque
 from tqdm import tqdm
+from metrics import timed, PAGES_CRAWLED, BYTES_DOWNLOADED, BOILERPLATE_BYTES
+import dedup
 
 def is_same_domain(a, b):
     return urlparse(a).netloc == urlparse(b).netloc
@@ -24,6 +26,13 @@ def fetch_text(url, timeout=10):
     except Exception as e:
         return ''
 
+def page_blocks(soup):
+    '''Visible text of a parsed page as a list of blocks (roughly one per element).'''
+    for script in soup(['script','style','noscript']):
+        script.decompose()
+    blocks = (clean_text(line) for line in soup.get_text(separator='\n').split('\n'))
+    return [b for b in blocks if b]
+
 def extract_links(base, html):
     soup = BeautifulSoup(html, 'html.parser')
     out = set()
@@ -36,8 +45,10 @@ def extract_links(base, html):
             out.add(u)
     return out
 
-def crawler_ingest(start_url, max_pages=50, max_depth=2):
-    '''Crawl same-domain links up to max_pages and max_depth and return list of dicts {url, text}.'''
+def crawler_ingest(start_url, max_pages=50, max_depth=2, delay=0.2, strip_boilerplate=True):
+    '''Crawl same-domain links up to max_pages and max_depth and return list of dicts {url, text, raw_bytes}.
+    delay is the pause between requests in seconds. With strip_boilerplate, text blocks repeated
+    across the crawled pages (menus, footers, banners) are removed; raw_bytes is the text size before.'''
     q = deque()
     q.append((start_url, 0))
     seen = set([start_url])
@@ -45,26 +56,38 @@ def crawler_ingest(start_url, max_pages=50, max_depth=2):
     while q and len(results) < max_pages:
         url, depth = q.popleft()
         try:
-            r = requests.get(url, timeout=10, headers={'User-Agent':'rag-bot/1.0'})
+            with timed('fetch'):
+                r = requests.get(url, timeout=10, headers={'User-Agent':'rag-bot/1.0'})
         except Exception:
             continue
+        BYTES_DOWNLOADED.inc(len(r.content))
         if 'text/html' not in r.headers.get('Content-Type',''):
             continue
-        text = ''
-        try:
-            soup = BeautifulSoup(r.text, 'html.parser')
-            for script in soup(['script','style','noscript']):
-                script.decompose()
-            text = clean_text(soup.get_text(separator=' '))
-        except Exception:
-            text = ''
-        results.append({'url': url, 'text': text})
+        PAGES_CRAWLED.inc()
+        blocks = []
+        with timed('parse'):
+            try:
+                blocks = page_blocks(BeautifulSoup(r.text, 'html.parser'))
+            except Exception:
+                blocks = []
+        results.append({'url': url, 'blocks': blocks})
         if depth < max_depth:
-            links = extract_links(url, r.text)
+            with timed('parse'):
+                links = extract_links(url, r.text)
             for l in links:
                 if l not in seen:
                     seen.add(l)
                     q.append((l, depth+1))
         # be polite
-        time.sleep(0.2)
+        if delay:
+            time.sleep(delay)
+    with timed('boilerplate'):
+        if strip_boilerplate:
+            texts = dedup.strip_boilerplate([r['blocks'] for r in results])
+        else:
+            texts = [' '.join(r['blocks']) for r in results]
+    for r, text in zip(results, texts):
+        r['raw_bytes'] = len(' '.join(r.pop('blocks')).encode('utf-8'))
+        r['text'] = text
+        BOILERPLATE_BYTES.inc(r['raw_bytes'] - len(text.encode('utf-8')))
     return results
@@ -0,0 +1,151 @@
+"""Lightweight in-process metrics rendered in the Prometheus text format.
+
+Kept dependency-free on purpose: the backend only needs counters, gauges and
+histograms, and a scrape of /metrics just renders whatever is in the registry.
+"""
+import time, threading, contextvars
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+_registry = []
+# stage -> seconds for the current request; a contextvar so async handlers get their own
+_timings = contextvars.ContextVar('rag_request_timings', default=None)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+def _format_labels(names, values, extra=None):
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{k}="{_escape(v)}"' for k, v in pairs) + '}'
+
+class _Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+        _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(n, '')) for n in self.labelnames)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_value(key, value))
+        return lines
+
+    def _render_value(self, key, value):
+        return [f'{self.name}{_format_labels(self.labelnames, key)} {value}']
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # per-bucket counts, then sum and count
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+            state[1] += value
+            state[2] += 1
+
+    def _render_value(self, key, state):
+        lines = []
+        counts, total, count = state
+        for bound, n in zip(self.buckets, counts):
+            labels = _format_labels(self.labelnames, key, ('le', repr(float(bound))))
+            lines.append(f'{self.name}_bucket{labels} {n}')
+        lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, ("le", "+Inf"))} {count}')
+        lines.append(f'{self.name}_sum{_format_labels(self.labelnames, key)} {total}')
+        lines.append(f'{self.name}_count{_format_labels(self.labelnames, key)} {count}')
+        return lines
+
+def render():
+    """Render every registered metric in Prometheus text exposition format."""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+STAGE_SECONDS = Histogram('rag_stage_seconds', 'Time spent in each pipeline stage.', ['stage'])
+HTTP_REQUEST_SECONDS = Histogram('rag_http_request_seconds', 'End-to-end HTTP request latency.', ['route', 'status'])
+PAGES_CRAWLED = Counter('rag_pages_crawled_total', 'HTML pages fetched by the crawler.')
+BYTES_DOWNLOADED = Counter('rag_bytes_downloaded_total', 'Response bytes downloaded by the crawler.')
+BOILERPLATE_BYTES = Counter('rag_boilerplate_bytes_stripped_total', 'Text bytes of repeated boilerplate removed from crawled pages.')
+NEAR_DUPLICATES = Counter('rag_near_duplicates_skipped_total', 'Pages not embedded because a near-identical page is stored.')
+NEAR_DUPLICATE_BYTES = Counter('rag_near_duplicate_bytes_skipped_total', 'Text bytes of near-duplicate pages not embedded or stored.')
+EMBEDDINGS_COMPUTED = Counter('rag_embeddings_computed_total', 'Texts passed through the embedding model.')
+LLM_REQUESTS = Counter('rag_llm_requests_total', 'Completions answered, by provider.', ['provider'])
+LLM_FALLBACKS = Counter('rag_llm_fallbacks_total', 'Providers that failed and fell through to the next one.', ['provider'])
+INDEX_DOCUMENTS = Gauge('rag_index_documents', 'Vectors held in the in-memory index.')
+INDEX_PARTITIONS = Gauge('rag_index_partitions', 'Collections with an in-memory index partition.')
+INDEX_BYTES = Gauge('rag_index_bytes', 'Size of the in-memory embedding matrix in bytes.')
+SHARD_WORKER_RESTARTS = Counter('rag_shard_worker_restarts_total', 'Shard worker processes restarted after exiting.')
+
+@contextmanager
+def timed(stage):
+    """Time a block, record it in the stage histogram and in the per-request timings."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        timings = _timings.get()
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + elapsed
+
+def start_request_timing():
+    _timings.set({})
+
+def finish_request_timing():
+    timings = _timings.get() or {}
+    _timings.set(None)
+    return timings
+
+def server_timing_header(timings, total=None):
+    """Format stage timings (seconds) as a Server-Timing header value."""
+    parts = [f'{stage};dur={elapsed * 1000:.1f}' for stage, elapsed in timings.items()]
+    if total is not None:
+        parts.append(f'total;dur={total * 1000:.1f}')
+    return ', '.join(parts)
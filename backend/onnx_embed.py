@@ -0,0 +1,144 @@
+"""ONNX Runtime embedding backend: the sentence encoder without PyTorch at inference time.
+
+The model rag.py uses is exported once to ONNX (and optionally quantized to dynamic
+int8) under RAG_ONNX_DIR; later loads only need onnxruntime, tokenizers and numpy.
+Embeddings are mean-pooled and L2-normalized exactly like sentence-transformers, so
+they go into the same 384-dim index.
+
+    python onnx_embed.py export [--int8]
+"""
+import os, inspect, argparse
+import numpy as np
+
+import rag
+
+ONNX_DIR = os.environ.get('RAG_ONNX_DIR') or os.path.join(os.path.dirname(__file__), 'onnx_models')
+# intra-op threads per inference; more than the physical cores only adds contention
+ONNX_THREADS = int(os.environ.get('RAG_ONNX_THREADS', os.cpu_count() or 1))
+# all-MiniLM-L6-v2 was trained on 256-token inputs; sentence-transformers truncates there too
+MAX_SEQ_LENGTH = 256
+INPUT_NAMES = ('input_ids', 'attention_mask', 'token_type_ids')
+
+def _hub_name(model_name):
+    # sentence-transformers resolves bare names under its own organisation
+    return model_name if '/' in model_name else f'sentence-transformers/{model_name}'
+
+def model_dir(model_name=None):
+    return os.path.join(ONNX_DIR, _hub_name(model_name or rag.MODEL_NAME).replace('/', '--'))
+
+def _model_path(directory, quantized):
+    return os.path.join(directory, 'model.int8.onnx' if quantized else 'model.onnx')
+
+def _last_hidden_state(model, names):
+    """The model as a module taking `names` positionally and returning last_hidden_state.
+
+    Newer transformers wrap forward(), so traced positional inputs no longer line up
+    with its parameters; the wrapper passes them by keyword.
+    """
+    import torch
+
+    class Encoder(torch.nn.Module):
+        def __init__(self):
+            super().__init__()
+            self.model = model
+
+        def forward(self, *inputs):
+            return self.model(**dict(zip(names, inputs)), return_dict=True).last_hidden_state
+
+    return Encoder().eval()
+
+def export_model(model_name=None, quantize=False):
+    """Export the encoder to ONNX (needs torch and transformers); returns the model directory."""
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+    name = _hub_name(model_name or rag.MODEL_NAME)
+    directory = model_dir(name)
+    os.makedirs(directory, exist_ok=True)
+    fp32_path = _model_path(directory, False)
+    if not os.path.exists(fp32_path):
+        tokenizer = AutoTokenizer.from_pretrained(name)
+        model = AutoModel.from_pretrained(name).eval()
+        sample = tokenizer(['an example sentence'], return_tensors='pt')
+        names = [n for n in INPUT_NAMES if n in sample]
+        axes = {0: 'batch', 1: 'sequence'}
+        # torch 2.9+ defaults to the dynamo exporter, which needs onnxscript and ignores dynamic_axes
+        legacy = {'dynamo': False} if 'dynamo' in inspect.signature(torch.onnx.export).parameters else {}
+        with torch.no_grad():
+            torch.onnx.export(_last_hidden_state(model, names), tuple(sample[n] for n in names), fp32_path,
+                              input_names=names, output_names=['last_hidden_state'],
+                              dynamic_axes={**{n: axes for n in names}, 'last_hidden_state': axes},
+                              opset_version=14, **legacy)
+        # writes tokenizer.json, all the runtime needs to tokenize
+        tokenizer.save_pretrained(directory)
+    if quantize and not os.path.exists(_model_path(directory, True)):
+        from onnxruntime.quantization import quantize_dynamic, QuantType
+        quantize_dynamic(fp32_path, _model_path(directory, True), weight_type=QuantType.QInt8)
+    return directory
+
+class OnnxEmbedder:
+    """Drop-in for SentenceTransformer.encode over an exported model."""
+
+    def __init__(self, directory, quantized=False, threads=ONNX_THREADS):
+        import onnxruntime as ort
+        from tokenizers import Tokenizer
+        options = ort.SessionOptions()
+        options.intra_op_num_threads = threads
+        options.inter_op_num_threads = 1
+        options.execution_mode = ort.ExecutionMode.ORT_SEQUENTIAL
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(_model_path(directory, quantized), options,
+                                            providers=['CPUExecutionProvider'])
+        self.input_names = [i.name for i in self.session.get_inputs()]
+        self.tokenizer = Tokenizer.from_file(os.path.join(directory, 'tokenizer.json'))
+        self.tokenizer.enable_truncation(MAX_SEQ_LENGTH)
+        pad_id = self.tokenizer.token_to_id('[PAD]') or 0
+        self.tokenizer.enable_padding(pad_id=pad_id, pad_token='[PAD]')
+
+    def _embed_batch(self, texts):
+        encodings = self.tokenizer.encode_batch(texts)
+        feeds = {
+            'input_ids': np.array([e.ids for e in encodings], dtype='int64'),
+            'attention_mask': np.array([e.attention_mask for e in encodings], dtype='int64'),
+            'token_type_ids': np.array([e.type_ids for e in encodings], dtype='int64'),
+        }
+        hidden = self.session.run(None, {n: feeds[n] for n in self.input_names})[0]
+        # mean over real tokens, as sentence-transformers' pooling layer does
+        mask = feeds['attention_mask'][..., None].astype('float32')
+        return (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+
+    def encode(self, texts, normalize_embeddings=True, batch_size=64):
+        single = isinstance(texts, str)
+        if single:
+            texts = [texts]
+        # batching texts of similar length keeps padding, and wasted compute, low
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        out = None
+        for start in range(0, len(order), batch_size):
+            rows = order[start:start + batch_size]
+            embs = self._embed_batch([texts[i] for i in rows])
+            if out is None:
+                out = np.empty((len(texts), embs.shape[1]), dtype='float32')
+            out[rows] = embs
+        if out is None:
+            out = np.empty((0, rag.EMBED_DIM), dtype='float32')
+        if normalize_embeddings:
+            out /= np.clip(np.linalg.norm(out, axis=1, keepdims=True), 1e-12, None)
+        return out[0] if single else out
+
+def load(quantized=False):
+    """Load the exported model, exporting it first if this is the first run."""
+    directory = model_dir()
+    if not os.path.exists(_model_path(directory, quantized)):
+        export_model(quantize=quantized)
+    return OnnxEmbedder(directory, quantized=quantized)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Export the embedding model to ONNX.')
+    sub = parser.add_subparsers(dest='command', required=True)
+    exp = sub.add_parser('export', help=f'export {rag.MODEL_NAME} under {ONNX_DIR}')
+    exp.add_argument('--int8', action='store_true', help='also write a dynamically quantized int8 model')
+    args = parser.parse_args(argv)
+    print(export_model(quantize=args.int8))
+
+if __name__ == '__main__':
+    main()
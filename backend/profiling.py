@@ -0,0 +1,230 @@
+"""On-demand profiling of live requests, driven by the /admin/profile routes in app.py.
+
+A session profiles the requests to chosen routes for the next N requests or T
+seconds, whichever comes first:
+
+- cprofile: a cProfile.Profile per request thread, merged into one pstats report
+- sample:   a background thread records the stacks of threads serving those
+            requests every few milliseconds; output is collapsed stacks, one
+            "frame;frame;frame count" line per stack, ready for flamegraph.pl
+
+Either can add tracemalloc allocation tracking. When no session is active the
+request hooks only check `active is None`.
+"""
+import os, io, sys, time, hmac, pstats, cProfile, threading, tracemalloc
+from collections import Counter
+
+# /admin routes answer 404 unless this is set; requests must send it as X-Admin-Token
+ADMIN_TOKEN = os.environ.get('RAG_ADMIN_TOKEN')
+MODES = ('cprofile', 'sample')
+# summarized separately in every report
+HOT_PATHS = ('retrieve', 'rebuild_index', 'crawler_ingest', 'call_completion')
+HOT_PATH_MODULES = ('rag', 'ingest', 'asgi')
+DEFAULT_SECONDS = 30
+MAX_SECONDS = 600
+MAX_REQUESTS = 10000
+DEFAULT_INTERVAL_MS = 5
+# frames kept per tracemalloc traceback
+TRACEMALLOC_FRAMES = 25
+
+# the session being recorded, and the last one that finished
+active = None
+last = None
+_lock = threading.Lock()
+
+def authorized(token):
+    return bool(ADMIN_TOKEN) and token is not None and hmac.compare_digest(token, ADMIN_TOKEN)
+
+def _frame_name(frame):
+    module = frame.f_globals.get('__name__') or os.path.basename(frame.f_code.co_filename)
+    return f'{module}:{frame.f_code.co_name}'
+
+def _collapse(frame):
+    names = []
+    while frame is not None:
+        names.append(_frame_name(frame))
+        frame = frame.f_back
+    return ';'.join(reversed(names))
+
+class Session:
+    def __init__(self, mode='cprofile', routes=None, requests=None, seconds=None,
+                 trace_allocations=False, interval_ms=DEFAULT_INTERVAL_MS):
+        if mode not in MODES:
+            raise ValueError(f'mode must be one of {MODES}')
+        if requests is None and seconds is None:
+            seconds = DEFAULT_SECONDS
+        if requests is not None and not 0 < int(requests) <= MAX_REQUESTS:
+            raise ValueError(f'requests must be between 1 and {MAX_REQUESTS}')
+        # a request count alone must not leave a session open forever
+        seconds = MAX_SECONDS if seconds is None else float(seconds)
+        if not 0 < seconds <= MAX_SECONDS:
+            raise ValueError(f'seconds must be between 0 and {MAX_SECONDS}')
+        if isinstance(routes, str):
+            routes = [routes]
+        if routes is not None and not (isinstance(routes, (list, tuple, set)) and all(isinstance(r, str) for r in routes)):
+            raise ValueError('routes must be a route or a list of routes')
+        self.mode = mode
+        self.routes = set(routes) if routes else None
+        self.requests = None if requests is None else int(requests)
+        self.seconds = seconds
+        self.trace_allocations = bool(trace_allocations)
+        self.interval = max(1.0, float(interval_ms)) / 1000.0
+        self.started = 0
+        self.completed = 0
+        self.started_at = time.time()
+        self.finished_at = None
+        self._stats = None
+        self._stacks = Counter()
+        # thread id -> route, for the sampler
+        self._threads = {}
+        # guards _stacks and _threads, shared by the sampler, request threads and readers
+        self._data_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._owns_tracemalloc = False
+        self._allocations = None
+
+    def start(self):
+        if self.trace_allocations and not tracemalloc.is_tracing():
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+            self._owns_tracemalloc = True
+        if self.mode == 'sample':
+            threading.Thread(target=self._sample_loop, name='rag-profile-sampler', daemon=True).start()
+        timer = threading.Timer(self.seconds, stop, args=(self,))
+        timer.daemon = True
+        timer.start()
+
+    def begin(self, route):
+        """Start profiling the current request; returns a handle for end(), or None if not profiled."""
+        if self.routes is not None and route not in self.routes:
+            return None
+        with _lock:
+            if self._stopped.is_set() or (self.requests is not None and self.started >= self.requests):
+                return None
+            self.started += 1
+        if self.mode == 'cprofile':
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+            except ValueError:
+                # another profiler owns this thread; this request no longer counts towards the session
+                with _lock:
+                    self.started -= 1
+                return None
+            return profiler
+        ident = threading.get_ident()
+        with self._data_lock:
+            self._threads[ident] = route
+        return ident
+
+    def end(self, handle):
+        if self.mode == 'cprofile':
+            handle.disable()
+            with _lock:
+                if self._stats is None:
+                    self._stats = pstats.Stats(handle)
+                else:
+                    self._stats.add(handle)
+        else:
+            with self._data_lock:
+                self._threads.pop(handle, None)
+        with _lock:
+            self.completed += 1
+            done = self.requests is not None and self.completed >= self.requests
+        if done:
+            stop(self)
+
+    def _sample_loop(self):
+        while not self._stopped.wait(self.interval):
+            frames = sys._current_frames()
+            with self._data_lock:
+                idents = list(self._threads)
+            stacks = [_collapse(frames[ident]) for ident in idents if ident in frames]
+            with self._data_lock:
+                self._stacks.update(stacks)
+
+    def _stack_counts(self):
+        # a copy, as the sampler keeps adding stacks while a session runs
+        with self._data_lock:
+            return Counter(self._stacks)
+
+    def finish(self):
+        self._stopped.set()
+        self.finished_at = time.time()
+        if self.trace_allocations and tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot()
+            self._allocations = [{'where': str(s.traceback[0]), 'size_kb': s.size / 1024, 'count': s.count}
+                                 for s in snapshot.statistics('lineno')[:30]]
+            if self._owns_tracemalloc:
+                tracemalloc.stop()
+
+    def _hot_paths(self):
+        out = {}
+        if self.mode == 'cprofile':
+            entries = self._stats.stats.items() if self._stats is not None else ()
+            for (filename, _, func), (_, calls, _, cumulative, _) in entries:
+                if func in HOT_PATHS and os.path.basename(filename)[:-3] in HOT_PATH_MODULES:
+                    entry = out.setdefault(func, {'calls': 0, 'cumulative_seconds': 0.0})
+                    entry['calls'] += calls
+                    entry['cumulative_seconds'] += cumulative
+        else:
+            stacks = self._stack_counts()
+            total = sum(stacks.values())
+            for func in HOT_PATHS:
+                names = {f'{m}:{func}' for m in HOT_PATH_MODULES}
+                n = sum(count for stack, count in stacks.items() if names & set(stack.split(';')))
+                if n:
+                    out[func] = {'samples': n, 'share': n / total}
+        return out
+
+    def output(self, limit=60):
+        """pstats text (cprofile) or collapsed stacks (sample)."""
+        if self.mode == 'sample':
+            return ''.join(f'{stack} {count}\n' for stack, count in self._stack_counts().most_common())
+        if self._stats is None:
+            return ''
+        buf = io.StringIO()
+        self._stats.stream = buf
+        self._stats.sort_stats('cumulative').print_stats(limit)
+        return buf.getvalue()
+
+    def report(self):
+        body = {
+            'mode': self.mode,
+            'routes': sorted(self.routes) if self.routes else 'all',
+            'running': not self._stopped.is_set(),
+            'requests_profiled': self.completed,
+            'started_at': self.started_at,
+            'seconds': (self.finished_at or time.time()) - self.started_at,
+            'hot_paths': self._hot_paths(),
+        }
+        if self.mode == 'sample':
+            body['samples'] = sum(self._stack_counts().values())
+        if self._allocations is not None:
+            body['allocations'] = self._allocations
+        return body
+
+def start(**options):
+    """Start a session; raises RuntimeError if one is running, ValueError for bad options."""
+    global active
+    session = Session(**options)
+    with _lock:
+        if active is not None:
+            raise RuntimeError('a profiling session is already running')
+        active = session
+    session.start()
+    return session
+
+def stop(session=None):
+    """Finish the given (or the active) session; returns it, or None if nothing was running."""
+    global active, last
+    with _lock:
+        session = session or active
+        if session is None or session is not active:
+            return None
+        active = None
+        last = session
+    session.finish()
+    return session
+
+def current():
+    return active or last
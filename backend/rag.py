@@ -1,30 +1,93 @@
-import sqlite3, os, json, pickle, time
+import sqlite3, os, json, pickle, time, threading, hashlib
 import numpy as np
-from sentence_transformers import SentenceTransformer
-from sklearn.neighbors import NearestNeighbors
-from groq import Groq
-from transformers import pipeline
+from urllib.parse import urlparse
 from threading import Lock
+import rerank
+import dedup
+import admission
+import shards
+from metrics import timed, NEAR_DUPLICATES, NEAR_DUPLICATE_BYTES, EMBEDDINGS_COMPUTED, LLM_REQUESTS, LLM_FALLBACKS, INDEX_DOCUMENTS, INDEX_BYTES, INDEX_PARTITIONS
+
+# sentence_transformers, groq and transformers are imported where they are
+# used: together they take several seconds to import and most requests never need them.
 
 MODEL_NAME = 'all-MiniLM-L6-v2'  # for fallback embeddings
 EMBED_DIM = 384
 lock = Lock()
+# set once the embedding model and the vector index are loaded (see start_background_init)
+ready = threading.Event()
+init_error = None
+
+embedder = None
+# collection -> {'embeddings': float32 matrix, 'norms': row norms, 'ids': doc ids by row}.
+# Partitions are replaced whole, never mutated, so readers can use them without the lock.
+partitions = {}
+# worker processes searching a sharded store (see shards.py); started on first use
+shard_pool = None
+_shard_pool_lock = Lock()
+
+def _load_sentence_transformer():
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(MODEL_NAME)
+
+def _load_onnx():
+    import onnx_embed
+    return onnx_embed.load()
+
+def _load_onnx_int8():
+    import onnx_embed
+    return onnx_embed.load(quantized=True)
+
+# name -> zero-arg factory returning an object with encode(text, normalize_embeddings=True);
+# RAG_EMBED_BACKEND picks one at init_store time
+EMBED_BACKENDS = {
+    'sentence-transformers': _load_sentence_transformer,
+    # same model through ONNX Runtime (exported on first use), fp32 or dynamic int8
+    'onnx': _load_onnx,
+    'onnx-int8': _load_onnx_int8,
+}
+
+def load_embedder(backend=None):
+    name = backend or os.environ.get('RAG_EMBED_BACKEND', 'sentence-transformers')
+    if name not in EMBED_BACKENDS:
+        raise ValueError(f'Unknown embedding backend {name!r}, expected one of {sorted(EMBED_BACKENDS)}')
+    return EMBED_BACKENDS[name]()
 
 def get_db_conn(path):
     conn = sqlite3.connect(path, check_same_thread=False)
     return conn
 
-def init_store(db_path):
-    # create tables if not present
-    conn = get_db_conn(db_path)
-    c = conn.cursor()
-    c.execute('''CREATE TABLE IF NOT EXISTS docs (
+# also used for the snapshot import staging table
+DOCS_TABLE_SQL = '''CREATE TABLE IF NOT EXISTS {table} (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         url TEXT UNIQUE,
         content TEXT,
         embedding BLOB,
-        created_at REAL
-    )''')
+        created_at REAL,
+        collection TEXT NOT NULL DEFAULT 'default',
+        simhash INTEGER
+    )'''
+
+def init_db(db_path):
+    # create tables if not present
+    conn = get_db_conn(db_path)
+    c = conn.cursor()
+    c.execute(DOCS_TABLE_SQL.format(table='docs'))
+    c.execute('PRAGMA table_info(docs)')
+    columns = [r[1] for r in c.fetchall()]
+    if 'collection' not in columns:
+        # stores created before collections existed: tag every doc with its domain
+        c.execute("ALTER TABLE docs ADD COLUMN collection TEXT NOT NULL DEFAULT 'default'")
+        c.execute('SELECT id, url FROM docs')
+        c.executemany('UPDATE docs SET collection=? WHERE id=?',
+                      [(collection_for_url(url), doc_id) for doc_id, url in c.fetchall()])
+    if 'simhash' not in columns:
+        # stores created before near-duplicate detection: fingerprint existing content once
+        c.execute('ALTER TABLE docs ADD COLUMN simhash INTEGER')
+        c.execute('SELECT id, content FROM docs')
+        c.executemany('UPDATE docs SET simhash=? WHERE id=?',
+                      [(dedup.simhash(content or ''), doc_id) for doc_id, content in c.fetchall()])
+    c.execute('CREATE INDEX IF NOT EXISTS idx_docs_collection ON docs (collection)')
     c.execute('''CREATE TABLE IF NOT EXISTS chats (
         id INTEGER PRIMARY KEY AUTOINCREMENT,
         session_id TEXT,
@@ -34,75 +97,379 @@ def init_store(db_path):
     )''')
     conn.commit()
     conn.close()
-    # load embedding model (fallback)
-    global embedder, vector_index, embeddings_matrix, doc_ids
-    embedder = SentenceTransformer(MODEL_NAME)
-    embeddings_matrix = None
-    doc_ids = []
-    vector_index = None
-    rebuild_index(db_path)
-
-def add_document(db_path, url, content):
-    conn = get_db_conn(db_path)
-    c = conn.cursor()
+
+def load_model():
+    global embedder
+    with timed('model_load'):
+        embedder = load_embedder()
+
+def init_store(db_path):
+    """Create tables, load the embedding model and the vector index, blocking until done."""
+    init_db(db_path)
+    shards.configure(db_path)
+    load_model()
+    load_index(db_path)
+    ready.set()
+
+def start_background_init(db_path):
+    """Create tables now and load the model and index on a background thread.
+
+    The database is usable as soon as this returns; anything that needs embeddings
+    or the index should check `ready` first.
+    """
+    init_db(db_path)
+    shards.configure(db_path)
+
+    def run():
+        global init_error
+        try:
+            load_index(db_path)
+            load_model()
+            ready.set()
+        except Exception as e:
+            init_error = e
+            print('Store initialization failed:', e)
+
+    thread = threading.Thread(target=run, name='rag-init', daemon=True)
+    thread.start()
+    return thread
+
+def collection_for_url(url):
+    """Default collection of a document: the domain of its URL (bare hosts are accepted too)."""
+    parsed = urlparse(url if '//' in url else '//' + url)
+    return parsed.netloc.lower() or 'default'
+
+def _collections_of_urls(c, urls):
+    found = set()
+    for i in range(0, len(urls), 500):
+        batch = urls[i:i + 500]
+        c.execute(f'SELECT DISTINCT collection FROM docs WHERE url IN ({",".join("?" * len(batch))})', batch)
+        found.update(r[0] for r in c.fetchall())
+    return found
+
+def add_document(db_path, url, content, collection=None):
+    return add_documents(db_path, [{'url': url, 'text': content}], collection=collection)
+
+def _drop_near_duplicates(db_path, docs, collection=None):
+    """Split docs into (kept, skipped) by SimHash against stored docs and earlier docs in the batch.
+
+    Only docs in the collection a doc is going to are compared, so a mirror ingested into
+    its own collection is still stored there. A doc is not compared with the stored copy
+    of its own URL, so re-ingesting a page still refreshes it.
+    """
+    groups = {}
+    for d in docs:
+        groups.setdefault(collection or collection_for_url(d['url']), []).append(d)
+    skipped = set()
+    for name, group in groups.items():
+        rows = []
+        # near-duplicates usually have different URLs, so every shard is checked
+        for path in shards.paths(db_path):
+            conn = get_db_conn(path)
+            c = conn.cursor()
+            c.execute('SELECT url, simhash FROM docs WHERE collection=? AND simhash IS NOT NULL', (name,))
+            rows.extend(c.fetchall())
+            conn.close()
+        position = {r[0]: i for i, r in enumerate(rows)}
+        known = dedup.SimHashIndex([r[1] for r in rows])
+        for d in group:
+            if known.find(d['simhash'], exclude=position.get(d['url'])):
+                skipped.add(id(d))
+                continue
+            # later docs with this URL in the batch replace this one, so don't count it against them
+            position[d['url']] = known.add(d['simhash'])
+    return [d for d in docs if id(d) not in skipped], [d for d in docs if id(d) in skipped]
+
+def add_documents(db_path, docs, collection=None, skip_near_duplicates=True, update_index=True, embed_batch_size=64):
+    """Embed and store a batch of {url, text} docs in one transaction.
+
+    Docs go to `collection`, or to their URL's domain when it is not given. With
+    skip_near_duplicates, docs whose SimHash is within dedup.MAX_HAMMING bits of a
+    stored doc in the same collection are neither embedded nor stored. Only the
+    index partitions of the collections touched by the batch are rebuilt, and none
+    without update_index (bulk loads rebuild once at the end). Returns counts of what was added and
+    skipped, and the touched collections.
+    """
+    docs = [d if 'simhash' in d else dict(d, simhash=dedup.simhash(d['text'])) for d in docs]
+    skipped = []
+    if skip_near_duplicates and docs:
+        with timed('dedup'):
+            docs, skipped = _drop_near_duplicates(db_path, docs, collection)
+    skipped_bytes = sum(len(d['text'].encode('utf-8')) for d in skipped)
+    NEAR_DUPLICATES.inc(len(skipped))
+    NEAR_DUPLICATE_BYTES.inc(skipped_bytes)
+    stats = {'added': len(docs), 'duplicates_skipped': len(skipped), 'duplicate_bytes_skipped': skipped_bytes,
+             'collections': []}
+    if not docs:
+        return stats
+    embs = compute_embeddings([d['text'] for d in docs], batch_size=embed_batch_size)
     now = time.time()
-    # compute embedding (try OpenAI then fallback)
-    emb = compute_embedding(content)
-    emb_blob = pickle.dumps(emb)
-    try:
-        c.execute('INSERT OR REPLACE INTO docs (url, content, embedding, created_at) VALUES (?,?,?,?)',
-                  (url, content, emb_blob, now))
-        conn.commit()
-    finally:
-        conn.close()
-    rebuild_index(db_path)
+    rows = [(d['url'], d['text'], pickle.dumps(emb), now, collection or collection_for_url(d['url']), d['simhash'])
+            for d, emb in zip(docs, embs)]
+    # one transaction per owning shard (a single one when the store is not sharded)
+    by_path = {}
+    for row in rows:
+        by_path.setdefault(shards.path_for_url(db_path, row[0]), []).append(row)
+    touched = {}
+    for path, shard_rows in by_path.items():
+        conn = get_db_conn(path)
+        c = conn.cursor()
+        try:
+            with timed('store'):
+                # a replaced URL may be moving out of another collection
+                names = _collections_of_urls(c, [r[0] for r in shard_rows])
+                c.executemany('INSERT OR REPLACE INTO docs (url, content, embedding, created_at, collection, simhash) VALUES (?,?,?,?,?,?)',
+                              shard_rows)
+                conn.commit()
+        finally:
+            conn.close()
+        touched[path] = names | {r[4] for r in shard_rows}
+    stats['collections'] = sorted(set().union(*touched.values()))
+    if update_index:
+        _rebuild_touched(db_path, touched)
+    return stats
 
-def rebuild_index(db_path):
-    global embeddings_matrix, doc_ids, vector_index
+def _rebuild_touched(db_path, touched):
+    """Rebuild the partitions in {shard path: collection names}."""
+    if shards.count(db_path) == 1:
+        for name in touched.get(db_path, ()):
+            rebuild_index(db_path, name)
+        return
+    order = shards.paths(db_path)
+    get_shard_pool(db_path).rebuild({order.index(path): names for path, names in touched.items()})
+
+def index_snapshot_dir(db_path):
+    return db_path + '.index'
+
+def _snapshot_path(db_path, collection):
+    name = hashlib.sha1(collection.encode('utf-8')).hexdigest()[:20]
+    return os.path.join(index_snapshot_dir(db_path), name + '.npz')
+
+def _fingerprints(db_path, collection=None):
+    """collection -> (count, max id, created_at total); changes on every insert, replace and delete."""
     conn = get_db_conn(db_path)
     c = conn.cursor()
-    c.execute('SELECT id, embedding FROM docs')
+    sql = 'SELECT collection, COUNT(*), MAX(id), TOTAL(created_at) FROM docs'
+    if collection is None:
+        c.execute(sql + ' GROUP BY collection')
+    else:
+        c.execute(sql + ' WHERE collection=? GROUP BY collection', (collection,))
     rows = c.fetchall()
     conn.close()
-    mats = []
-    ids = []
-    for r in rows:
-        ids.append(r[0])
-        emb = pickle.loads(r[1])
-        mats.append(emb)
-    if mats:
-        X = np.vstack(mats)
-        vector_index = NearestNeighbors(n_neighbors=10, metric='cosine').fit(X)
-        embeddings_matrix = X
-        doc_ids = ids
+    return {r[0]: np.array(r[1:], dtype='float64') for r in rows}
+
+def _save_snapshot(db_path, collection, part, fingerprint):
+    os.makedirs(index_snapshot_dir(db_path), exist_ok=True)
+    path = _snapshot_path(db_path, collection)
+    tmp = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+    with open(tmp, 'wb') as f:
+        np.savez(f, collection=np.array(collection), embeddings=part['embeddings'],
+                 ids=np.asarray(part['ids'], dtype='int64'), fingerprint=fingerprint)
+    os.replace(tmp, path)
+
+def _load_snapshot(db_path, collection, fingerprint):
+    path = _snapshot_path(db_path, collection)
+    if not os.path.exists(path):
+        return None
+    try:
+        with np.load(path) as snap:
+            if str(snap['collection']) != collection or not np.array_equal(snap['fingerprint'], fingerprint):
+                return None
+            X = snap['embeddings']
+            return _make_partition(X, [int(i) for i in snap['ids']])
+    except Exception as e:
+        print(f'Index snapshot for {collection!r} unreadable, rebuilding:', e)
+        return None
+
+def load_index(db_path):
+    """Load every collection's partition from its snapshot when it is current, else rebuild it."""
+    global partitions
+    if shards.count(db_path) > 1:
+        # each shard worker loads its own partitions, in parallel
+        get_shard_pool(db_path)
+        return
+    # held until the partitions are installed, so a snapshot import cannot swap the
+    # documents between reading the fingerprints and replacing the partitions
+    with lock:
+        fingerprints = _fingerprints(db_path)
+        loaded = {}
+        stale = []
+        with timed('index_load'):
+            for name, fingerprint in fingerprints.items():
+                part = _load_snapshot(db_path, name, fingerprint)
+                if part is None:
+                    stale.append(name)
+                else:
+                    loaded[name] = part
+        partitions = loaded
+    for name in stale:
+        _rebuild_partition(db_path, name, fingerprints[name])
+    _remove_orphan_snapshots(db_path, fingerprints)
+    _update_index_gauges()
+
+def _remove_orphan_snapshots(db_path, collections):
+    snap_dir = index_snapshot_dir(db_path)
+    if not os.path.isdir(snap_dir):
+        return
+    keep = {os.path.basename(_snapshot_path(db_path, name)) for name in collections}
+    for fname in os.listdir(snap_dir):
+        if fname not in keep:
+            try:
+                os.remove(os.path.join(snap_dir, fname))
+            except OSError:
+                pass
+
+def _make_partition(X, ids):
+    X = np.ascontiguousarray(X, dtype='float32')
+    norms = np.linalg.norm(X, axis=1)
+    norms[norms == 0] = 1.0
+    return {'embeddings': X, 'norms': norms, 'ids': ids}
+
+def _nearest(part, q_emb, q_norm, k):
+    # brute-force cosine distance, the same scan sklearn's NearestNeighbors(metric='cosine') does,
+    # without its per-call overhead (which dominates once a query touches many partitions)
+    dists = 1.0 - (part['embeddings'] @ q_emb) / (part['norms'] * q_norm)
+    if k < len(dists):
+        idxs = np.argpartition(dists, k - 1)[:k]
+    else:
+        idxs = np.arange(len(dists))
+    return [(float(dists[i]), part['ids'][i]) for i in idxs]
+
+def _update_index_gauges():
+    parts = list(partitions.values())
+    INDEX_PARTITIONS.set(len(parts))
+    INDEX_DOCUMENTS.set(sum(len(p['ids']) for p in parts))
+    INDEX_BYTES.set(sum(p['embeddings'].nbytes for p in parts))
+
+def get_shard_pool(db_path):
+    global shard_pool
+    with _shard_pool_lock:
+        if shard_pool is None:
+            shard_pool = shards.ShardPool(db_path)
+    return shard_pool
+
+def rebuild_index(db_path, collection=None):
+    """Rebuild one collection's index partition from stored embeddings, or every partition."""
+    if shards.count(db_path) > 1:
+        get_shard_pool(db_path).rebuild_all(None if collection is None else [collection])
+        return
+    if collection is not None:
+        _rebuild_partition(db_path, collection)
     else:
-        embeddings_matrix = None
-        doc_ids = []
-        vector_index = None
+        fingerprints = _fingerprints(db_path)
+        for name in list(partitions):
+            if name not in fingerprints:
+                _drop_partition(db_path, name)
+        for name, fingerprint in fingerprints.items():
+            _rebuild_partition(db_path, name, fingerprint)
+    _update_index_gauges()
+
+def _drop_partition(db_path, collection):
+    partitions.pop(collection, None)
+    try:
+        os.remove(_snapshot_path(db_path, collection))
+    except OSError:
+        pass
+
+def _rebuild_partition(db_path, collection, fingerprint=None):
+    if fingerprint is None:
+        fingerprint = _fingerprints(db_path, collection).get(collection)
+    with timed('index_rebuild'):
+        conn = get_db_conn(db_path)
+        c = conn.cursor()
+        c.execute('SELECT id, embedding FROM docs WHERE collection=?', (collection,))
+        rows = c.fetchall()
+        conn.close()
+        if not rows:
+            _drop_partition(db_path, collection)
+            return
+        ids = [r[0] for r in rows]
+        X = np.vstack([pickle.loads(r[1]) for r in rows])
+        part = partitions[collection] = _make_partition(X, ids)
+    try:
+        with lock:
+            _save_snapshot(db_path, collection, part, fingerprint)
+    except OSError as e:
+        print('Could not save index snapshot:', e)
 
 def compute_embedding(text):
     # Use local sentence-transformers for embeddings (Groq doesn't have embedding models)
-    global embedder
-    emb = embedder.encode(text, normalize_embeddings=True)
+    if embedder is None:
+        raise RuntimeError('Embedding model is not loaded yet')
+    with timed('embed'):
+        emb = embedder.encode(text, normalize_embeddings=True)
+    EMBEDDINGS_COMPUTED.inc()
     return emb.astype('float32')
 
-def retrieve(db_path, query, top_k=4):
-    # compute query embedding
-    q_emb = compute_embedding(query)
-    if vector_index is None:
-        return []
-    dists, idxs = vector_index.kneighbors([q_emb], n_neighbors=min(top_k, len(doc_ids)))
-    results = []
-    for dist, idx in zip(dists[0], idxs[0]):
-        doc_id = doc_ids[idx]
-        # fetch doc
+def compute_embeddings(texts, batch_size=64):
+    """Embed many texts in batches; returns a float32 matrix with one row per text."""
+    if embedder is None:
+        raise RuntimeError('Embedding model is not loaded yet')
+    with timed('embed'):
+        embs = embedder.encode(list(texts), normalize_embeddings=True, batch_size=batch_size)
+    EMBEDDINGS_COMPUTED.inc(len(texts))
+    return np.asarray(embs, dtype='float32').reshape(len(texts), -1)
+
+def _names(value, field):
+    if isinstance(value, str):
+        return [value]
+    if isinstance(value, (list, tuple)) and all(isinstance(v, str) for v in value):
+        return list(value)
+    raise ValueError(f'{field} must be a name or a list of names')
+
+def resolve_collections(collection=None, domain=None):
+    """Turn a /chat collection or domain filter into a list of collection names (None = all).
+
+    Raises ValueError when a filter is neither a string nor a list of strings.
+    """
+    if collection:
+        return _names(collection, 'collection')
+    if domain:
+        return [collection_for_url(d) for d in _names(domain, 'domain')]
+    return None
+
+def search(q_emb, top_k, collections=None):
+    """Nearest (distance, doc_id) pairs across the given partitions, or all of them."""
+    current = partitions
+    names = list(current) if collections is None else collections
+    q_emb = np.asarray(q_emb, dtype='float32')
+    q_norm = float(np.linalg.norm(q_emb)) or 1.0
+    hits = []
+    with timed('search'):
+        for name in names:
+            part = current.get(name)
+            if part is None:
+                continue
+            hits.extend(_nearest(part, q_emb, q_norm, top_k))
+    hits.sort()
+    return hits[:top_k]
+
+def fetch_documents(db_path, ids):
+    """id -> (url, content, collection) for the given doc ids."""
+    if not ids:
+        return {}
+    with timed('db_fetch'):
         conn = get_db_conn(db_path)
         c = conn.cursor()
-        c.execute('SELECT url, content FROM docs WHERE id=?',(doc_id,))
-        row = c.fetchone()
+        c.execute(f'SELECT id, url, content, collection FROM docs WHERE id IN ({",".join("?" * len(ids))})', list(ids))
+        rows = c.fetchall()
         conn.close()
+    return {r[0]: r[1:] for r in rows}
+
+def retrieve(db_path, query, top_k=4, collections=None):
+    """Top-k documents for query, searching only the partitions in `collections` when given."""
+    # compute query embedding
+    q_emb = compute_embedding(query)
+    if shards.count(db_path) > 1:
+        with timed('search'):
+            return get_shard_pool(db_path).search(q_emb, top_k, collections)
+    hits = search(q_emb, top_k, collections)
+    docs = fetch_documents(db_path, [doc_id for _, doc_id in hits])
+    results = []
+    for dist, doc_id in hits:
+        row = docs.get(doc_id)
         if row:
-            results.append({'url': row[0], 'content': row[1], 'score': float(1 - dist)})
+            results.append({'url': row[0], 'content': row[1], 'collection': row[2], 'score': float(1 - dist)})
     return results
 
 def save_chat(db_path, session_id, role, message):
@@ -114,11 +481,32 @@ def save_chat(db_path, session_id, role, message):
     conn.commit()
     conn.close()
 
-def chat_with_retrieval(db_path, session_id, message, top_k=4):
+GROQ_MODEL = 'deepseek-r1-distill-llama-70b'  # Fast and efficient model
+
+def retrieve_for_chat(db_path, message, top_k=4, collections=None, use_rerank=None):
+    """Docs for a chat prompt; with reranking, over-fetch and keep the top_k best by cross-encoder."""
+    if use_rerank is None:
+        use_rerank = rerank.RERANK_ENABLED
+    if use_rerank:
+        candidates = retrieve(db_path, message, top_k=max(top_k, rerank.RERANK_CANDIDATES), collections=collections)
+        return rerank.rerank(message, candidates, top_k)
+    return retrieve(db_path, message, top_k=top_k, collections=collections)
+
+def chat_with_retrieval(db_path, session_id, message, top_k=4, collections=None, use_rerank=None):
     # save user message
     save_chat(db_path, session_id, 'user', message)
     # retrieve relevant docs
-    hits = retrieve(db_path, message, top_k=top_k)
+    hits = retrieve_for_chat(db_path, message, top_k=top_k, collections=collections, use_rerank=use_rerank)
+    system_message, user_message = build_prompt(message, hits)
+    # call LLM with proper system and user messages; identical questions in flight share one call
+    with timed('llm'):
+        resp_text = admission.llm_calls.do(admission.coalesce_key(message, hits), call_completion, system_message, user_message)
+    # save assistant reply
+    save_chat(db_path, session_id, 'assistant', resp_text)
+    return {'answer': resp_text, 'sources': [h['url'] for h in hits]}
+
+def build_prompt(message, hits):
+    """(system message, user message) for a question and its retrieved docs."""
     context = '\n\n'.join([f'URL: {h["url"]}\n{h["content"][:2000]}' for h in hits])
     # Create a clean, focused prompt that doesn't expose system instructions
     system_message = """You are a helpful AI assistant that answers questions based on the provided context. 
@@ -134,31 +522,37 @@ def chat_with_retrieval(db_path, session_id, message, top_k=4):
 Question: {message}
 
 Please provide a well-structured answer based on the context above."""
-    # call LLM with proper system and user messages
-    resp_text = call_completion(system_message, user_message)
-    # save assistant reply
-    save_chat(db_path, session_id, 'assistant', resp_text)
-    return {'answer': resp_text, 'sources': [h['url'] for h in hits]}
+    return system_message, user_message
+
+def groq_payload(system_message, user_message):
+    """Request body for Groq's OpenAI-compatible chat completions API."""
+    return {
+        'model': GROQ_MODEL,
+        'messages': [
+            {'role':'system','content':system_message},
+            {'role':'user','content':user_message}
+        ],
+        'max_tokens': 1024,
+        'temperature': 0.0,
+    }
 
 def call_completion(system_message, user_message):
     # Try Groq LLM first
     groq_key = os.environ.get('GROQ_API_KEY')
     if groq_key:
         try:
+            from groq import Groq
             client = Groq(api_key=groq_key)
-            completion = client.chat.completions.create(
-                model='deepseek-r1-distill-llama-70b',  # Fast and efficient model
-                messages=[
-                    {'role':'system','content':system_message},
-                    {'role':'user','content':user_message}
-                ],
-                max_tokens=1024,
-                temperature=0.0,
-            )
+            completion = client.chat.completions.create(**groq_payload(system_message, user_message))
+            LLM_REQUESTS.inc(provider='groq')
             return completion.choices[0].message.content.strip()
         except Exception as e:
             print('Groq completion failed, falling back:', e)
-    
+            LLM_FALLBACKS.inc(provider='groq')
+    return fallback_completion(system_message, user_message)
+
+def fallback_completion(system_message, user_message):
+    """The providers tried after Groq: Hugging Face Inference API, then a local model."""
     # Try Hugging Face Inference API if key present
     hf_key = os.environ.get('HUGGINGFACE_API_KEY')
     if hf_key:
@@ -172,31 +566,45 @@ def call_completion(system_message, user_message):
             r = requests.post(API_URL, headers=headers, json=payload, timeout=30)
             data = r.json()
             if isinstance(data, list) and 'generated_text' in data[0]:
+                LLM_REQUESTS.inc(provider='huggingface')
                 return data[0]['generated_text'].strip()
             if isinstance(data, dict) and 'error' in data:
                 print('HF Inference error', data['error'])
             # sometimes returns dict with 'generated_text'
             if isinstance(data, dict) and 'generated_text' in data:
+                LLM_REQUESTS.inc(provider='huggingface')
                 return data['generated_text']
         except Exception as e:
             print('HF inference failed:', e)
+        LLM_FALLBACKS.inc(provider='huggingface')
     
     # Fallback to local transformers (may require model download)
     try:
+        from transformers import pipeline
         generator = pipeline('text-generation', model='distilgpt2')
         # Combine system and user messages for local model
         combined_prompt = f"{system_message}\n\n{user_message}"
         out = generator(combined_prompt, max_length=300, do_sample=False)
+        LLM_REQUESTS.inc(provider='local')
         return out[0]['generated_text'].strip()
     except Exception as e:
         print('Local generation failed:', e)
+        LLM_FALLBACKS.inc(provider='local')
+    LLM_REQUESTS.inc(provider='none')
     return "I don't know based on ingested data."
 
+def _doc_count(path):
+    conn = get_db_conn(path)
+    c = conn.cursor()
+    c.execute('SELECT COUNT(*) FROM docs')
+    count = c.fetchone()[0]
+    conn.close()
+    return count
+
 def get_stats(db_path):
+    docs = sum(_doc_count(path) for path in shards.paths(db_path))
     conn = get_db_conn(db_path)
     c = conn.cursor()
-    c.execute('SELECT COUNT(*) FROM docs')
-    docs = c.fetchone()[0]
     c.execute('SELECT COUNT(*) FROM chats')
     chats = c.fetchone()[0]
     conn.close()
@@ -215,28 +623,34 @@ def get_stats(db_path):
     }
 
 def get_urls(db_path):
-    conn = get_db_conn(db_path)
-    c = conn.cursor()
-    c.execute('SELECT url FROM docs ORDER BY created_at DESC LIMIT 100')
-    rows = c.fetchall()
-    conn.close()
-    return [r[0] for r in rows]
+    rows = []
+    for path in shards.paths(db_path):
+        conn = get_db_conn(path)
+        c = conn.cursor()
+        c.execute('SELECT created_at, url FROM docs ORDER BY created_at DESC LIMIT 100')
+        rows.extend(c.fetchall())
+        conn.close()
+    rows.sort(reverse=True)
+    return [r[1] for r in rows[:100]]
 
 def delete_document(db_path, url):
-    """Delete a document by URL and rebuild the index"""
-    conn = get_db_conn(db_path)
+    """Delete a document by URL and rebuild its collection's index partition"""
+    path = shards.path_for_url(db_path, url)
+    conn = get_db_conn(path)
     c = conn.cursor()
+    c.execute('SELECT collection FROM docs WHERE url = ?', (url,))
+    row = c.fetchone()
     c.execute('DELETE FROM docs WHERE url = ?', (url,))
     deleted_count = c.rowcount
     conn.commit()
     conn.close()
     if deleted_count > 0:
-        rebuild_index(db_path)
+        _rebuild_touched(db_path, {path: {row[0]}})
     return deleted_count > 0
 
 def get_document_content(db_path, url):
     """Get the content of a specific document by URL"""
-    conn = get_db_conn(db_path)
+    conn = get_db_conn(shards.path_for_url(db_path, url))
     c = conn.cursor()
     c.execute('SELECT content FROM docs WHERE url = ?', (url,))
     row = c.fetchone()
@@ -245,21 +659,55 @@ def get_document_content(db_path, url):
 
 def get_all_documents(db_path):
     """Get all documents with their URLs and content"""
-    conn = get_db_conn(db_path)
-    c = conn.cursor()
-    c.execute('SELECT url, content, created_at FROM docs ORDER BY created_at DESC')
-    rows = c.fetchall()
-    conn.close()
-    return [{'url': row[0], 'content': row[1], 'created_at': row[2]} for row in rows]
+    rows = []
+    for path in shards.paths(db_path):
+        conn = get_db_conn(path)
+        c = conn.cursor()
+        c.execute('SELECT url, content, created_at, collection FROM docs ORDER BY created_at DESC')
+        rows.extend(c.fetchall())
+        conn.close()
+    rows.sort(key=lambda row: row[2], reverse=True)
+    return [{'url': row[0], 'content': row[1], 'created_at': row[2], 'collection': row[3]} for row in rows]
+
+def get_collections(db_path):
+    """Return every collection with its document count"""
+    counts = {}
+    for path in shards.paths(db_path):
+        conn = get_db_conn(path)
+        c = conn.cursor()
+        c.execute('SELECT collection, COUNT(*) FROM docs GROUP BY collection')
+        for name, n in c.fetchall():
+            counts[name] = counts.get(name, 0) + n
+        conn.close()
+    return [{'collection': name, 'docs': counts[name]} for name in sorted(counts)]
+
+def delete_collection(db_path, collection):
+    """Delete all documents of one collection; other partitions are untouched"""
+    deleted_count = 0
+    for path in shards.paths(db_path):
+        conn = get_db_conn(path)
+        c = conn.cursor()
+        c.execute('DELETE FROM docs WHERE collection = ?', (collection,))
+        deleted_count += c.rowcount
+        conn.commit()
+        conn.close()
+    if shards.count(db_path) > 1:
+        get_shard_pool(db_path).drop(collection)
+        return deleted_count
+    _drop_partition(db_path, collection)
+    _update_index_gauges()
+    return deleted_count
 
 def delete_all_documents(db_path):
     """Delete all documents and rebuild the index"""
-    conn = get_db_conn(db_path)
-    c = conn.cursor()
-    c.execute('DELETE FROM docs')
-    deleted_count = c.rowcount
-    conn.commit()
-    conn.close()
+    deleted_count = 0
+    for path in shards.paths(db_path):
+        conn = get_db_conn(path)
+        c = conn.cursor()
+        c.execute('DELETE FROM docs')
+        deleted_count += c.rowcount
+        conn.commit()
+        conn.close()
     if deleted_count > 0:
         rebuild_index(db_path)
     return deleted_count
@@ -0,0 +1,127 @@
+"""Optional second retrieval stage: rescore vector-search candidates with a cross-encoder.
+
+The vector index over-fetches candidates, the cross-encoder scores every (query, doc)
+pair in one batch and only the best few go into the LLM prompt. Scores are cached per
+(query, doc) and the stage is skipped when its estimated cost exceeds the latency budget.
+"""
+import os, time, hashlib, threading
+from collections import OrderedDict
+from metrics import timed, Counter
+
+RERANK_MODEL = os.environ.get('RAG_RERANK_MODEL', 'cross-encoder/ms-marco-MiniLM-L-6-v2')
+RERANK_ENABLED = os.environ.get('RAG_RERANK', '').lower() in ('1', 'true', 'yes')
+# candidates fetched from the vector index before reranking
+RERANK_CANDIDATES = int(os.environ.get('RAG_RERANK_CANDIDATES', 20))
+RERANK_BUDGET_MS = float(os.environ.get('RAG_RERANK_BUDGET_MS', 150))
+RERANK_CACHE_SIZE = int(os.environ.get('RAG_RERANK_CACHE_SIZE', 10000))
+# characters of each document shown to the cross-encoder (it truncates to 512 tokens anyway)
+RERANK_DOC_CHARS = 2000
+# after this many budget skips, rerank once anyway to re-measure the per-pair cost
+PROBE_EVERY = 50
+
+RERANK_SKIPPED = Counter('rag_rerank_skipped_total', 'Rerank stages skipped, by reason.', ['reason'])
+RERANK_CACHE = Counter('rag_rerank_cache_total', 'Cross-encoder score cache lookups.', ['result'])
+
+def _load_cross_encoder():
+    from sentence_transformers import CrossEncoder
+    return CrossEncoder(RERANK_MODEL)
+
+# name -> zero-arg factory returning an object with predict(list of (query, doc) pairs)
+RERANK_BACKENDS = {
+    'cross-encoder': _load_cross_encoder,
+}
+
+_model = None
+_model_lock = threading.Lock()
+_loading = None
+_load_error = None
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+# exponential moving average of scoring cost per uncached pair, in seconds
+_pair_seconds = None
+_skips_since_probe = 0
+
+def _load():
+    global _model, _load_error
+    name = os.environ.get('RAG_RERANK_BACKEND', 'cross-encoder')
+    try:
+        with timed('rerank_model_load'):
+            model = RERANK_BACKENDS[name]()
+        with _model_lock:
+            _model = model
+    except Exception as e:
+        _load_error = e
+        print('Reranker failed to load:', e)
+
+def load_reranker(block=True):
+    """Load the cross-encoder, on a background thread when block is False."""
+    global _loading
+    with _model_lock:
+        busy = _loading is not None and _loading.is_alive()
+        # a failed load is only retried by an explicit blocking call
+        if _model is not None or busy or (_load_error is not None and not block):
+            thread = _loading
+        else:
+            thread = _loading = threading.Thread(target=_load, name='rag-rerank-load', daemon=True)
+            thread.start()
+    if block and thread is not None:
+        thread.join()
+    return _model
+
+def _doc_key(query, hit):
+    doc = hit['content'][:RERANK_DOC_CHARS]
+    return query, hashlib.sha1(doc.encode('utf-8')).hexdigest()
+
+def _cache_get(key):
+    with _cache_lock:
+        score = _cache.get(key)
+        if score is not None:
+            _cache.move_to_end(key)
+        return score
+
+def _cache_put(key, score):
+    with _cache_lock:
+        _cache[key] = score
+        _cache.move_to_end(key)
+        while len(_cache) > RERANK_CACHE_SIZE:
+            _cache.popitem(last=False)
+
+def _skip(hits, top_n, reason):
+    RERANK_SKIPPED.inc(reason=reason)
+    return hits[:top_n]
+
+def rerank(query, hits, top_n, budget_ms=None):
+    """Return the top_n hits by cross-encoder score, or the first top_n if reranking is skipped.
+
+    hits are retrieve() results in vector order; reranked hits gain a 'rerank_score' key.
+    """
+    global _pair_seconds, _skips_since_probe
+    if len(hits) <= 1:
+        return hits[:top_n]
+    if _model is None:
+        # never make a chat wait on a model download
+        load_reranker(block=False)
+        return _skip(hits, top_n, 'model_unavailable' if _load_error is not None else 'model_loading')
+    budget = (RERANK_BUDGET_MS if budget_ms is None else budget_ms) / 1000.0
+    keys = [_doc_key(query, h) for h in hits]
+    scores = [_cache_get(k) for k in keys]
+    missing = [i for i, s in enumerate(scores) if s is None]
+    RERANK_CACHE.inc(len(hits) - len(missing), result='hit')
+    RERANK_CACHE.inc(len(missing), result='miss')
+    if missing and _pair_seconds is not None and _pair_seconds * len(missing) > budget:
+        _skips_since_probe += 1
+        if _skips_since_probe < PROBE_EVERY:
+            return _skip(hits, top_n, 'over_budget')
+    if missing:
+        _skips_since_probe = 0
+        pairs = [(query, hits[i]['content'][:RERANK_DOC_CHARS]) for i in missing]
+        start = time.perf_counter()
+        with timed('rerank'):
+            new_scores = _model.predict(pairs)
+        per_pair = (time.perf_counter() - start) / len(pairs)
+        _pair_seconds = per_pair if _pair_seconds is None else 0.8 * _pair_seconds + 0.2 * per_pair
+        for i, score in zip(missing, new_scores):
+            scores[i] = float(score)
+            _cache_put(keys[i], scores[i])
+    order = sorted(range(len(hits)), key=lambda i: scores[i], reverse=True)[:top_n]
+    return [dict(hits[i], rerank_score=scores[i]) for i in order]
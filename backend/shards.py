@@ -0,0 +1,379 @@
+"""Sharded document store: N SQLite shards by URL hash, each searched by its own worker process.
+
+With one shard (the default) documents live in the main database and rag.py searches
+them in-process. With more, documents move to <db>.shards/shard-NNN.db. A document's
+shard is its URL hash modulo the shard count. Each shard gets a worker process that
+holds that shard's index partitions in memory. rag.retrieve sends the query vector
+to every worker at once and merges their top-k results. Writes go straight to the
+owning shard database, followed by a partition rebuild in its worker. Chats stay in
+the main database.
+
+The shard count is stored in <db>.shards/layout.json. RAG_SHARDS only takes effect
+on an empty store; existing documents are moved with the offline rebalance command
+(stop the server first):
+
+    python shards.py status
+    python shards.py rebalance --shards 4
+"""
+import os, sys, json, time, heapq, atexit, shutil, socket, hashlib, argparse, threading, subprocess
+from multiprocessing.connection import Connection
+
+import metrics
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+# shards for a new, empty store; 0 follows whatever layout is on disk
+SHARDS = int(os.environ.get('RAG_SHARDS', 0))
+# rows copied per transaction by rebalance
+BATCH_ROWS = 1000
+# seconds to wait for a worker to exit before killing it
+STOP_TIMEOUT = 5
+
+_layouts = {}
+
+def shard_dir(db_path):
+    return db_path + '.shards'
+
+def _layout_path(db_path):
+    return os.path.join(shard_dir(db_path), 'layout.json')
+
+def _shard_paths(root, n):
+    return [os.path.join(root, f'shard-{i:03d}.db') for i in range(n)]
+
+def count(db_path):
+    """Number of shards of the store at db_path (1 when it is not sharded)."""
+    n = _layouts.get(db_path)
+    if n is None:
+        try:
+            with open(_layout_path(db_path)) as f:
+                n = int(json.load(f)['shards'])
+        except FileNotFoundError:
+            n = 1
+        _layouts[db_path] = n
+    return n
+
+def paths(db_path):
+    """SQLite files holding the documents, in shard order."""
+    n = count(db_path)
+    return [db_path] if n == 1 else _shard_paths(shard_dir(db_path), n)
+
+def shard_of(url, n):
+    if n == 1:
+        return 0
+    return int.from_bytes(hashlib.blake2b(url.encode('utf-8'), digest_size=8).digest(), 'big') % n
+
+def path_for_url(db_path, url):
+    shard_paths = paths(db_path)
+    return shard_paths[shard_of(url, len(shard_paths))]
+
+def configure(db_path):
+    """Apply RAG_SHARDS to an empty store; warn when it disagrees with a populated one."""
+    import rag
+    for path in paths(db_path):
+        rag.init_db(path)
+    if not SHARDS or SHARDS == count(db_path):
+        return
+    if sum(rag._doc_count(path) for path in paths(db_path)) == 0:
+        rebalance(db_path, SHARDS)
+    else:
+        print(f'Store has {count(db_path)} shard(s) but RAG_SHARDS={SHARDS}; '
+              f'run `python shards.py rebalance --shards {SHARDS}` with the server stopped to reshard it.')
+
+def rebalance(db_path, n, log=None):
+    """Redistribute every document over n shards (offline: no server may be using the store).
+
+    Rows are copied in batches into a staging location and swapped in at the end, so
+    an interrupted run leaves the current layout intact. Returns what was moved.
+    """
+    import rag
+    if n < 1:
+        raise ValueError('shard count must be at least 1')
+    old_paths = paths(db_path)
+    old_n = len(old_paths)
+    if n == old_n:
+        return {'shards': n, 'previous_shards': old_n, 'documents': 0, 'seconds': 0.0}
+    start = time.perf_counter()
+    root = shard_dir(db_path)
+    staging = root + '.new'
+    shutil.rmtree(staging, ignore_errors=True)
+    if n > 1:
+        os.makedirs(staging)
+        targets = _shard_paths(staging, n)
+        for path in targets:
+            rag.init_db(path)
+        conns = [rag.get_db_conn(path) for path in targets]
+        table = 'docs'
+    else:
+        # back into the main database, through a staging table swapped in at the end
+        rag.init_db(db_path)
+        conns = [rag.get_db_conn(db_path)]
+        table = 'docs_rebalance'
+        conns[0].execute(f'DROP TABLE IF EXISTS {table}')
+        conns[0].execute(rag.DOCS_TABLE_SQL.format(table=table))
+    moved = 0
+    try:
+        for path in old_paths:
+            src = rag.get_db_conn(path)
+            cur = src.execute('SELECT url, content, embedding, created_at, collection, simhash FROM docs ORDER BY id')
+            while True:
+                rows = cur.fetchmany(BATCH_ROWS)
+                if not rows:
+                    break
+                by_shard = {}
+                for row in rows:
+                    by_shard.setdefault(shard_of(row[0], n), []).append(row)
+                for i, batch in by_shard.items():
+                    conns[i].executemany(f'INSERT OR REPLACE INTO {table} (url, content, embedding, created_at, collection, simhash) '
+                                         'VALUES (?,?,?,?,?,?)', batch)
+                    conns[i].commit()
+                moved += len(rows)
+                if log:
+                    log(f'{moved} documents copied')
+            src.close()
+    finally:
+        for conn in conns:
+            conn.close()
+
+    if n > 1:
+        with open(os.path.join(staging, 'layout.json'), 'w') as f:
+            json.dump({'shards': n}, f)
+        if os.path.isdir(root):
+            os.rename(root, root + '.old')
+        os.rename(staging, root)
+        shutil.rmtree(root + '.old', ignore_errors=True)
+    else:
+        conn = rag.get_db_conn(db_path)
+        c = conn.cursor()
+        c.execute('BEGIN IMMEDIATE')
+        c.execute('DROP TABLE docs')
+        c.execute(f'ALTER TABLE {table} RENAME TO docs')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_docs_collection ON docs (collection)')
+        conn.commit()
+        conn.close()
+        shutil.rmtree(root, ignore_errors=True)
+    if old_n == 1:
+        # the documents now live in the shards
+        conn = rag.get_db_conn(db_path)
+        conn.execute('DELETE FROM docs')
+        conn.commit()
+        conn.close()
+        shutil.rmtree(rag.index_snapshot_dir(db_path), ignore_errors=True)
+    _layouts[db_path] = n
+    return {'shards': n, 'previous_shards': old_n, 'documents': moved, 'seconds': time.perf_counter() - start}
+
+# -- worker process ---------------------------------------------------------
+
+def _index_info():
+    import rag
+    parts = rag.partitions.values()
+    return {'documents': sum(len(p['ids']) for p in parts), 'partitions': len(rag.partitions),
+            'bytes': sum(p['embeddings'].nbytes for p in parts)}
+
+def _op_search(path, q_emb, top_k, collections):
+    import rag
+    hits = rag.search(q_emb, top_k, collections)
+    docs = rag.fetch_documents(path, [doc_id for _, doc_id in hits])
+    return [{'url': docs[doc_id][0], 'content': docs[doc_id][1], 'collection': docs[doc_id][2], 'score': float(1 - dist)}
+            for dist, doc_id in hits if doc_id in docs]
+
+def _op_rebuild(path, collections):
+    import rag
+    if collections is None:
+        rag.rebuild_index(path)
+    else:
+        for name in collections:
+            rag.rebuild_index(path, name)
+
+def _op_drop(path, collection):
+    import rag
+    rag._drop_partition(path, collection)
+
+OPS = {'search': _op_search, 'rebuild': _op_rebuild, 'drop': _op_drop}
+
+def serve(path, fd):
+    """Worker main loop: own one shard's index and answer requests until the pipe closes."""
+    import rag
+    conn = Connection(fd)
+    rag.init_db(path)
+    rag.load_index(path)
+    conn.send((True, None, _index_info()))
+    while True:
+        try:
+            op, args = conn.recv()
+        except EOFError:
+            return
+        if op == 'stop':
+            return
+        try:
+            conn.send((True, OPS[op](path, *args), _index_info()))
+        except Exception as e:
+            conn.send((False, f'{type(e).__name__}: {e}', _index_info()))
+
+# -- coordinator ------------------------------------------------------------
+
+class WorkerLost(RuntimeError):
+    """A shard worker's pipe closed: the process exited or was killed."""
+
+class ShardPool:
+    """One worker process per shard; requests to several shards run in parallel.
+
+    A worker that dies is restarted on the next request that reaches it, and that
+    request is sent to the new worker once.
+    """
+
+    def __init__(self, db_path):
+        self.paths = paths(db_path)
+        self.procs = [None] * len(self.paths)
+        self.conns = [None] * len(self.paths)
+        self.locks = [threading.Lock() for _ in self.paths]
+        for i in range(len(self.paths)):
+            self._start(i)
+        self.info = [None] * len(self.paths)
+        atexit.register(self.close)
+        # workers load their partitions concurrently; wait for all of them
+        with metrics.timed('index_load'):
+            for i in range(len(self.paths)):
+                self._receive(i)
+        self._update_gauges()
+
+    def _start(self, i):
+        parent, child = socket.socketpair()
+        self.procs[i] = subprocess.Popen([sys.executable, os.path.abspath(__file__), 'serve', self.paths[i], '--fd', str(child.fileno())],
+                                         pass_fds=(child.fileno(),), cwd=BACKEND_DIR)
+        child.close()
+        self.conns[i] = Connection(parent.detach())
+
+    def _restart(self, i):
+        print(f'Shard worker {i} ({self.paths[i]}) exited with {self.procs[i].poll()}; restarting it')
+        metrics.SHARD_WORKER_RESTARTS.inc()
+        try:
+            self.conns[i].close()
+        except OSError:
+            pass
+        self.procs[i].kill()
+        self.procs[i].wait()
+        self._start(i)
+        # the new worker reports in once its partitions are loaded
+        self._receive(i)
+
+    def _send(self, i, op, args):
+        try:
+            self.conns[i].send((op, args))
+        except OSError:
+            raise WorkerLost(f'shard worker {i} ({self.paths[i]}) exited')
+
+    def _receive(self, i):
+        try:
+            ok, result, info = self.conns[i].recv()
+        except (EOFError, OSError):
+            raise WorkerLost(f'shard worker {i} ({self.paths[i]}) exited')
+        self.info[i] = info
+        if not ok:
+            raise RuntimeError(f'shard {i}: {result}')
+        return result
+
+    def call(self, shards, op, *args):
+        """Send one request to each of the given shards, then collect the replies in order."""
+        shards = sorted(shards)
+        # always locked in shard order, so concurrent callers cannot deadlock
+        for i in shards:
+            self.locks[i].acquire()
+        try:
+            lost = set()
+            for i in shards:
+                try:
+                    self._send(i, op, args)
+                except WorkerLost:
+                    lost.add(i)
+            results = {}
+            error = None
+            for i in shards:
+                if i in lost:
+                    continue
+                try:
+                    results[i] = self._receive(i)
+                except WorkerLost:
+                    lost.add(i)
+                except RuntimeError as e:
+                    # keep reading so every pipe is left ready for the next request
+                    error = error or e
+            # every op is safe to repeat, so a replaced worker gets the request again
+            for i in sorted(lost):
+                self._restart(i)
+                self._send(i, op, args)
+                results[i] = self._receive(i)
+            if error is not None:
+                raise error
+            return [results[i] for i in shards]
+        finally:
+            for i in shards:
+                self.locks[i].release()
+
+    def call_all(self, op, *args):
+        return self.call(range(len(self.paths)), op, *args)
+
+    def search(self, q_emb, top_k, collections=None):
+        """Scatter the query to every shard and merge their top-k lists."""
+        results = self.call_all('search', q_emb, top_k, collections)
+        return heapq.nlargest(top_k, (hit for hits in results for hit in hits), key=lambda h: h['score'])
+
+    def rebuild(self, collections_by_shard):
+        """Rebuild partitions: {shard index: collection names, or None for all}."""
+        for i, names in collections_by_shard.items():
+            self.call([i], 'rebuild', None if names is None else sorted(names))
+        self._update_gauges()
+
+    def rebuild_all(self, collections=None):
+        self.call_all('rebuild', collections)
+        self._update_gauges()
+
+    def drop(self, collection):
+        self.call_all('drop', collection)
+        self._update_gauges()
+
+    def _update_gauges(self):
+        infos = [i for i in self.info if i]
+        metrics.INDEX_DOCUMENTS.set(sum(i['documents'] for i in infos))
+        metrics.INDEX_PARTITIONS.set(sum(i['partitions'] for i in infos))
+        metrics.INDEX_BYTES.set(sum(i['bytes'] for i in infos))
+
+    def close(self):
+        for conn in self.conns:
+            if conn is None:
+                continue
+            try:
+                conn.send(('stop', ()))
+                conn.close()
+            except OSError:
+                pass
+        for proc in self.procs:
+            if proc is None:
+                continue
+            try:
+                proc.wait(STOP_TIMEOUT)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+        self.conns, self.procs = [], []
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Inspect or reshard the document store.')
+    parser.add_argument('--db', default=os.environ.get('RAG_DB_PATH') or os.path.join(BACKEND_DIR, 'rag_store.db'))
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('status', help='show the shard layout and documents per shard')
+    reb = sub.add_parser('rebalance', help='move every document to a new shard count (server must be stopped)')
+    reb.add_argument('--shards', type=int, required=True)
+    srv = sub.add_parser('serve', help=argparse.SUPPRESS)
+    srv.add_argument('path')
+    srv.add_argument('--fd', type=int, required=True)
+    args = parser.parse_args(argv)
+    if args.command == 'serve':
+        serve(args.path, args.fd)
+        return
+    import rag
+    if args.command == 'rebalance':
+        result = rebalance(args.db, args.shards, log=lambda line: print(line, file=sys.stderr))
+    else:
+        result = {'shards': count(args.db), 'documents': [rag._doc_count(path) for path in paths(args.db)]}
+    print(json.dumps(result))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,282 @@
+"""Knowledge-base snapshots: export and import documents with their embeddings.
+
+A snapshot is an uncompressed tar stream with, in order:
+
+    header.json      format version, embedding dtype and dimension, document count
+    index.json       collection -> [start, end) row range; rows are grouped by
+                     collection, so each range is that collection's index partition
+    docs.jsonl       one {url, content, collection, created_at, simhash} object per line
+    embeddings.bin   contiguous float32/float16 rows, same order as docs.jsonl
+    checksums.json   sha256 of every member above
+
+Import streams the tar (it never seeks), writes into a staging table in bounded
+batches, verifies every checksum and only then swaps the staging table in and
+installs the index partitions, so a corrupt or truncated snapshot leaves the live
+store untouched and nothing is re-embedded.
+
+    python snapshot.py export backup.ragsnap [--dtype float16]
+    python snapshot.py import backup.ragsnap
+"""
+import os, json, time, pickle, tarfile, hashlib, argparse, tempfile
+import numpy as np
+import rag
+import dedup
+import shards
+
+FORMAT = 'rag-snapshot'
+VERSION = 1
+DTYPES = ('float32', 'float16')
+# documents per staging insert / embedding rows per read
+BATCH_ROWS = 1000
+READ_CHUNK = 1 << 20
+
+class SnapshotError(Exception):
+    pass
+
+def _require_unsharded(db_path):
+    if shards.count(db_path) > 1:
+        raise SnapshotError('snapshots need an unsharded store; run `python shards.py rebalance --shards 1` first')
+
+def _add_member(tar, name, path):
+    info = tar.gettarinfo(path, arcname=name)
+    info.mtime = int(time.time())
+    with open(path, 'rb') as f:
+        tar.addfile(info, f)
+
+def _hash_file(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(READ_CHUNK), b''):
+            h.update(block)
+    return h.hexdigest()
+
+def export_snapshot(db_path, out, dtype='float16'):
+    """Write a snapshot of every document to `out` (a path or a writable binary file).
+
+    Rows are streamed from SQLite through temp files, so memory stays flat.
+    """
+    if dtype not in DTYPES:
+        raise SnapshotError(f'dtype must be one of {DTYPES}')
+    _require_unsharded(db_path)
+    with tempfile.TemporaryDirectory(prefix='rag-snapshot-') as tmp:
+        docs_path = os.path.join(tmp, 'docs.jsonl')
+        emb_path = os.path.join(tmp, 'embeddings.bin')
+        ranges = {}
+        count = 0
+        dim = None
+        conn = rag.get_db_conn(db_path)
+        try:
+            c = conn.cursor()
+            c.execute('SELECT url, content, collection, created_at, simhash, embedding FROM docs ORDER BY collection, id')
+            with open(docs_path, 'w', encoding='utf-8') as docs_f, open(emb_path, 'wb') as emb_f:
+                for url, content, collection, created_at, simhash, blob in c:
+                    emb = np.asarray(pickle.loads(blob), dtype=dtype).ravel()
+                    if dim is None:
+                        dim = emb.shape[0]
+                    elif emb.shape[0] != dim:
+                        raise SnapshotError(f'{url} has a {emb.shape[0]}-dim embedding, expected {dim}')
+                    docs_f.write(json.dumps({'url': url, 'content': content, 'collection': collection,
+                                             'created_at': created_at, 'simhash': simhash}) + '\n')
+                    emb_f.write(emb.tobytes())
+                    start = ranges.get(collection, [count])[0]
+                    ranges[collection] = [start, count + 1]
+                    count += 1
+        finally:
+            conn.close()
+        header = {'format': FORMAT, 'version': VERSION, 'dtype': dtype, 'dim': dim or rag.EMBED_DIM,
+                  'count': count, 'model': rag.MODEL_NAME, 'created_at': time.time()}
+        members = [('header.json', header), ('index.json', ranges), ('docs.jsonl', docs_path),
+                   ('embeddings.bin', emb_path)]
+        checksums = {}
+        for i, (name, value) in enumerate(members):
+            if not isinstance(value, str):
+                path = os.path.join(tmp, name)
+                with open(path, 'w') as f:
+                    json.dump(value, f)
+                members[i] = (name, path)
+            checksums[name] = _hash_file(members[i][1])
+        checksums_path = os.path.join(tmp, 'checksums.json')
+        with open(checksums_path, 'w') as f:
+            json.dump(checksums, f)
+        members.append(('checksums.json', checksums_path))
+        mode = 'w|'
+        if isinstance(out, str):
+            tar = tarfile.open(out, mode)
+        else:
+            tar = tarfile.open(fileobj=out, mode=mode)
+        with tar:
+            for name, path in members:
+                _add_member(tar, name, path)
+    return {'docs': count, 'dim': header['dim'], 'dtype': dtype, 'collections': len(ranges)}
+
+class _HashingReader:
+    """Read-through wrapper that hashes everything read from a tar member."""
+
+    def __init__(self, f):
+        self.f = f
+        self.sha = hashlib.sha256()
+
+    def read(self, n=-1):
+        data = self.f.read(n)
+        self.sha.update(data)
+        return data
+
+    def lines(self):
+        pending = b''
+        for block in iter(lambda: self.read(READ_CHUNK), b''):
+            pending += block
+            *complete, pending = pending.split(b'\n')
+            yield from complete
+        if pending:
+            yield pending
+
+def _read_json(reader):
+    data = b''.join(iter(lambda: reader.read(READ_CHUNK), b''))
+    return json.loads(data)
+
+def _create_staging(c):
+    c.execute('DROP TABLE IF EXISTS docs_import')
+    c.execute(rag.DOCS_TABLE_SQL.format(table='docs_import'))
+
+def import_snapshot(db_path, src):
+    """Replace every document in the store with the snapshot read from `src` (path or stream).
+
+    Chats are kept. Raises SnapshotError, leaving the live store unchanged, if the
+    snapshot is malformed, any checksum does not match, or its embeddings come from
+    another model or dimension. Memory use is one batch of
+    rows plus the float32 index being built, which the live store holds anyway.
+    """
+    _require_unsharded(db_path)
+    rag.init_db(db_path)
+    conn = rag.get_db_conn(db_path)
+    c = conn.cursor()
+    _create_staging(c)
+    conn.commit()
+    header = ranges = expected = None
+    digests = {}
+    docs_seen = rows_seen = 0
+    # collection -> list of float32 row blocks, installed as index partitions after the swap
+    staged = {}
+    try:
+        tar = tarfile.open(src, 'r|') if isinstance(src, str) else tarfile.open(fileobj=src, mode='r|')
+        with tar:
+            for member in tar:
+                f = tar.extractfile(member)
+                if f is None:
+                    continue
+                reader = _HashingReader(f)
+                if member.name == 'header.json':
+                    header = _read_json(reader)
+                    if header.get('format') != FORMAT or header.get('version') != VERSION:
+                        raise SnapshotError('not a supported snapshot')
+                    if header.get('dtype') not in DTYPES:
+                        raise SnapshotError(f"unsupported dtype {header.get('dtype')!r}")
+                    # the embeddings must come from the model that embeds queries against them
+                    if header.get('model') != rag.MODEL_NAME or header.get('dim') != rag.EMBED_DIM:
+                        raise SnapshotError(f"snapshot embeddings are from {header.get('model')!r} ({header.get('dim')}-dim), "
+                                            f'this store uses {rag.MODEL_NAME!r} ({rag.EMBED_DIM}-dim)')
+                elif member.name == 'index.json':
+                    ranges = _read_json(reader)
+                    bounds = sorted((start, end, name) for name, (start, end) in ranges.items())
+                elif member.name == 'docs.jsonl':
+                    if header is None or ranges is None:
+                        raise SnapshotError('docs.jsonl before header.json/index.json')
+                    batch = []
+                    for line in reader.lines():
+                        d = json.loads(line)
+                        start, end = ranges.get(d['collection'], (0, 0))
+                        if not start <= docs_seen < end:
+                            raise SnapshotError(f"{d['url']} is outside its collection's row range")
+                        docs_seen += 1
+                        simhash = d.get('simhash')
+                        if simhash is None:
+                            simhash = dedup.simhash(d['content'] or '')
+                        batch.append((docs_seen, d['url'], d['content'], d['created_at'], d['collection'], simhash))
+                        if len(batch) >= BATCH_ROWS:
+                            c.executemany('INSERT INTO docs_import (id, url, content, created_at, collection, simhash) VALUES (?,?,?,?,?,?)', batch)
+                            batch = []
+                    if batch:
+                        c.executemany('INSERT INTO docs_import (id, url, content, created_at, collection, simhash) VALUES (?,?,?,?,?,?)', batch)
+                    conn.commit()
+                elif member.name == 'embeddings.bin':
+                    if docs_seen != header['count']:
+                        raise SnapshotError(f"expected {header['count']} docs, got {docs_seen}")
+                    dtype = np.dtype(header['dtype'])
+                    row_bytes = dtype.itemsize * header['dim']
+                    for data in iter(lambda: reader.read(row_bytes * BATCH_ROWS), b''):
+                        if len(data) % row_bytes:
+                            raise SnapshotError('embeddings.bin is truncated')
+                        X = np.frombuffer(data, dtype=dtype).reshape(-1, header['dim']).astype('float32')
+                        if rows_seen + len(X) > docs_seen:
+                            raise SnapshotError('more embeddings than documents')
+                        # ids are row numbers + 1, as assigned to docs_import above
+                        c.executemany('UPDATE docs_import SET embedding=? WHERE id=?',
+                                      [(pickle.dumps(x), rows_seen + 1 + i) for i, x in enumerate(X)])
+                        first, last = rows_seen, rows_seen + len(X)
+                        for start, end, name in bounds:
+                            lo, hi = max(start, first), min(end, last)
+                            if lo < hi:
+                                staged.setdefault(name, []).append(X[lo - first:hi - first])
+                        rows_seen = last
+                    conn.commit()
+                elif member.name == 'checksums.json':
+                    expected = _read_json(reader)
+                    continue
+                digests[member.name] = reader.sha.hexdigest()
+        if header is None or expected is None:
+            raise SnapshotError('snapshot is missing header.json or checksums.json')
+        for name in ('header.json', 'index.json', 'docs.jsonl', 'embeddings.bin'):
+            if digests.get(name) is None or digests[name] != expected.get(name):
+                raise SnapshotError(f'checksum mismatch for {name}')
+        if rows_seen != header['count']:
+            raise SnapshotError(f"expected {header['count']} embeddings, got {rows_seen}")
+    except Exception as e:
+        c.execute('DROP TABLE IF EXISTS docs_import')
+        conn.commit()
+        conn.close()
+        if isinstance(e, SnapshotError):
+            raise
+        raise SnapshotError(f'malformed snapshot: {e}') from e
+
+    with rag.lock:
+        # one transaction: readers see either the old documents or the new ones
+        c.execute('BEGIN IMMEDIATE')
+        c.execute('ALTER TABLE docs RENAME TO docs_old')
+        c.execute('ALTER TABLE docs_import RENAME TO docs')
+        c.execute('DROP TABLE docs_old')
+        c.execute('CREATE INDEX IF NOT EXISTS idx_docs_collection ON docs (collection)')
+        conn.commit()
+        conn.close()
+        rag.partitions = {name: rag._make_partition(np.vstack(staged[name]), list(range(start + 1, end + 1)))
+                          for name, (start, end) in ranges.items() if end > start}
+    # snapshot files for the new partitions, so the next startup loads them directly
+    fingerprints = rag._fingerprints(db_path)
+    for name, part in list(rag.partitions.items()):
+        try:
+            rag._save_snapshot(db_path, name, part, fingerprints[name])
+        except OSError as e:
+            print('Could not save index snapshot:', e)
+    rag._remove_orphan_snapshots(db_path, fingerprints)
+    rag._update_index_gauges()
+    return {'docs': docs_seen, 'collections': len(rag.partitions), 'dtype': header['dtype']}
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Export or import a knowledge-base snapshot.')
+    parser.add_argument('--db', default=os.environ.get('RAG_DB_PATH') or os.path.join(os.path.dirname(__file__), 'rag_store.db'))
+    sub = parser.add_subparsers(dest='command', required=True)
+    exp = sub.add_parser('export', help='write a snapshot file')
+    exp.add_argument('path')
+    exp.add_argument('--dtype', choices=DTYPES, default='float16')
+    imp = sub.add_parser('import', help='replace all documents with a snapshot file')
+    imp.add_argument('path')
+    args = parser.parse_args(argv)
+    start = time.perf_counter()
+    if args.command == 'export':
+        result = export_snapshot(args.db, args.path, dtype=args.dtype)
+    else:
+        result = import_snapshot(args.db, args.path)
+    result['seconds'] = round(time.perf_counter() - start, 3)
+    print(json.dumps(result))
+
+if __name__ == '__main__':
+    main()
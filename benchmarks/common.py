@@ -0,0 +1,80 @@
+"""Shared helpers for the offline benchmark suite."""
+import os, sys, json, time, socket, platform, subprocess, threading
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BACKEND_DIR = os.path.join(ROOT, 'backend')
+if BACKEND_DIR not in sys.path:
+    sys.path.insert(0, BACKEND_DIR)
+
+def percentile(values, pct):
+    """Linear-interpolated percentile of a list of numbers (pct in 0..100)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    pos = (len(ordered) - 1) * pct / 100.0
+    lo = int(pos)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (pos - lo)
+
+def summarize(latencies):
+    """Summarize latencies given in seconds as milliseconds."""
+    if not latencies:
+        return {'count': 0}
+    ms = [l * 1000 for l in latencies]
+    return {
+        'count': len(ms),
+        'mean_ms': sum(ms) / len(ms),
+        'p50_ms': percentile(ms, 50),
+        'p90_ms': percentile(ms, 90),
+        'p99_ms': percentile(ms, 99),
+        'max_ms': max(ms),
+    }
+
+def git_revision():
+    try:
+        out = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                             capture_output=True, text=True, timeout=10)
+        return out.stdout.strip() or None
+    except Exception:
+        return None
+
+def environment():
+    return {
+        'git_revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'timestamp': time.time(),
+    }
+
+def write_results(results, path):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(results, f, indent=2, sort_keys=True)
+
+def use_stub_embedder(dim=384):
+    """Register the hashing stub embedder with rag and select it for init_store."""
+    import rag
+    from benchmarks.stubs import StubEmbedder
+    rag.EMBED_BACKENDS['stub'] = lambda: StubEmbedder(dim=dim)
+    os.environ['RAG_EMBED_BACKEND'] = 'stub'
+
+def serve_in_thread(server):
+    """Run an http.server / werkzeug server on a daemon thread and return its base URL."""
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    host, port = server.server_address[:2]
+    return f'http://{host}:{port}'
+
+def use_stub_reranker(pair_ms=0.5):
+    """Register the token-overlap stub cross-encoder with rerank and load it."""
+    import rerank
+    from benchmarks.stubs import StubCrossEncoder
+    rerank.RERANK_BACKENDS['stub'] = lambda: StubCrossEncoder(pair_ms=pair_ms)
+    os.environ['RAG_RERANK_BACKEND'] = 'stub'
+    return rerank.load_reranker(block=True)
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
@@ -0,0 +1,39 @@
+"""Compare two benchmark result files and print the relative change of every metric.
+
+    python -m benchmarks.compare old.json new.json
+"""
+import sys, json, argparse
+
+def _flatten(node, prefix=''):
+    if isinstance(node, dict):
+        for key, value in node.items():
+            yield from _flatten(value, f'{prefix}.{key}' if prefix else key)
+    elif isinstance(node, (int, float)) and not isinstance(node, bool):
+        yield prefix, node
+
+def compare(old, new):
+    """Return rows of (metric, old, new, change_pct) for metrics present in both runs."""
+    old_flat = dict(_flatten(old.get('scenarios', {})))
+    new_flat = dict(_flatten(new.get('scenarios', {})))
+    rows = []
+    for key in sorted(old_flat.keys() & new_flat.keys()):
+        a, b = old_flat[key], new_flat[key]
+        change = (b - a) / a * 100 if a else None
+        rows.append((key, a, b, change))
+    return rows
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('old')
+    parser.add_argument('new')
+    args = parser.parse_args(argv)
+    with open(args.old) as f:
+        old = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    for key, a, b, change in compare(old, new):
+        delta = f'{change:+.1f}%' if change is not None else 'n/a'
+        print(f'{key:60s} {a:>14.3f} {b:>14.3f} {delta:>9s}')
+
+if __name__ == '__main__':
+    sys.exit(main())
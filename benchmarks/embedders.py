@@ -0,0 +1,89 @@
+"""Embedding backend comparison: throughput, and parity with a reference backend.
+
+Every backend embeds the same synthetic corpus. Parity is the per-text cosine
+between a backend's embedding and the reference backend's, plus how many of each
+text's nearest neighbours stay the same, which is what retrieval sees. The exit
+status is 1 when any backend falls below --min-cosine, so this doubles as a check
+that a new backend can share an index built by another.
+
+    python -m benchmarks.embedders --backends sentence-transformers,onnx,onnx-int8
+"""
+import os, sys, json, time, random, argparse
+import numpy as np
+
+from benchmarks.common import environment, write_results, use_stub_embedder
+from benchmarks.site import WORDS
+
+def synthetic_texts(n, seed=7):
+    """n reproducible word-salad texts of 8-300 words."""
+    rng = random.Random(seed)
+    return [' '.join(rng.choice(WORDS) for _ in range(rng.randint(8, 300))) for _ in range(n)]
+
+def _neighbours(X, queries, k):
+    sims = X[:queries] @ X.T
+    # drop each text itself
+    np.fill_diagonal(sims[:, :queries], -np.inf)
+    return np.argsort(-sims, axis=1)[:, :k]
+
+def embedding_parity(ref, emb, queries, k):
+    """Cosine of each row of emb to the same row of ref, and overlap of the first `queries` rows' k nearest neighbours."""
+    cosines = (ref * emb).sum(axis=1)
+    ref_nn, nn = _neighbours(ref, queries, k), _neighbours(emb, queries, k)
+    overlap = [len(set(a) & set(b)) / k for a, b in zip(ref_nn, nn)]
+    return {'min_cosine': float(cosines.min()), 'mean_cosine': float(cosines.mean()),
+            f'neighbour_overlap_at_{k}': float(np.mean(overlap))}
+
+def bench_backend(name, texts, batch_sizes):
+    import rag
+    start = time.perf_counter()
+    embedder = rag.load_embedder(name)
+    out = {'load_seconds': time.perf_counter() - start, 'throughput': {}}
+    embedder.encode(texts[:8], normalize_embeddings=True)
+    embeddings = None
+    for batch_size in batch_sizes:
+        start = time.perf_counter()
+        embs = embedder.encode(texts, normalize_embeddings=True, batch_size=batch_size)
+        elapsed = time.perf_counter() - start
+        out['throughput'][str(batch_size)] = {'seconds': elapsed, 'texts_per_second': len(texts) / elapsed}
+        if embeddings is None:
+            embeddings = np.asarray(embs, dtype='float32')
+    out['dim'] = int(embeddings.shape[1])
+    return out, embeddings
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--backends', default='sentence-transformers,onnx,onnx-int8',
+                        help='comma-separated rag.EMBED_BACKENDS names; the first is the parity reference')
+    parser.add_argument('--texts', type=int, default=512)
+    parser.add_argument('--batch-sizes', default='16,64')
+    parser.add_argument('--queries', type=int, default=64, help='texts whose nearest neighbours are compared')
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--min-cosine', type=float, default=0.98,
+                        help='fail when any text embeds below this cosine to the reference')
+    parser.add_argument('--output', default=os.path.join(os.path.dirname(__file__), 'results', 'embedders.json'))
+    args = parser.parse_args(argv)
+    backends = args.backends.split(',')
+    batch_sizes = [int(b) for b in args.batch_sizes.split(',')]
+    if 'stub' in backends:
+        use_stub_embedder()
+
+    texts = synthetic_texts(args.texts)
+    results = {'environment': environment(), 'parameters': vars(args), 'backends': {}}
+    reference = None
+    failed = []
+    for name in backends:
+        out, embeddings = bench_backend(name, texts, batch_sizes)
+        if reference is None:
+            reference = embeddings
+        else:
+            out['parity'] = embedding_parity(reference, embeddings, min(args.queries, len(texts)), args.k)
+            if out['dim'] != reference.shape[1] or out['parity']['min_cosine'] < args.min_cosine:
+                failed.append(name)
+        results['backends'][name] = out
+    results['parity_failed'] = failed
+    print(json.dumps(results, indent=2))
+    write_results(results, args.output)
+    return results
+
+if __name__ == '__main__':
+    sys.exit(1 if main()['parity_failed'] else 0)
@@ -0,0 +1,70 @@
+"""Groq/OpenAI-compatible chat completion server with configurable latency.
+
+Point the backend at it with GROQ_BASE_URL=http://host:port and any GROQ_API_KEY.
+"""
+import json, time, argparse
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+class FakeLLMServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024
+
+    def __init__(self, address, latency_ms=200.0, ms_per_1k_chars=0.0):
+        super().__init__(address, FakeLLMHandler)
+        # fixed network/queueing cost plus a prefill cost proportional to prompt size
+        self.latency_ms = latency_ms
+        self.ms_per_1k_chars = ms_per_1k_chars
+        self.requests_served = 0
+        self.prompt_chars = []
+
+class FakeLLMHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        if not self.path.rstrip('/').endswith('/chat/completions'):
+            self.send_error(404)
+            return
+        length = int(self.headers.get('Content-Length', 0))
+        payload = json.loads(self.rfile.read(length) or b'{}')
+        messages = payload.get('messages', [])
+        prompt_chars = sum(len(m.get('content', '')) for m in messages)
+        server = self.server
+        time.sleep((server.latency_ms + server.ms_per_1k_chars * prompt_chars / 1000.0) / 1000.0)
+        server.requests_served += 1
+        server.prompt_chars.append(prompt_chars)
+        question = messages[-1]['content'][-200:] if messages else ''
+        body = json.dumps({
+            'id': f'chatcmpl-fake-{server.requests_served}',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': payload.get('model', 'fake'),
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': f'Fake answer ({prompt_chars} prompt chars) to: {question}'},
+                'finish_reason': 'stop',
+            }],
+            'usage': {'prompt_tokens': prompt_chars // 4, 'completion_tokens': 16,
+                      'total_tokens': prompt_chars // 4 + 16},
+        }).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--latency-ms', type=float, default=200.0)
+    parser.add_argument('--ms-per-1k-chars', type=float, default=0.0)
+    args = parser.parse_args()
+    server = FakeLLMServer((args.host, args.port), args.latency_ms, args.ms_per_1k_chars)
+    print(f'Fake LLM listening on http://{args.host}:{args.port}')
+    server.serve_forever()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,403 @@
+"""Offline end-to-end benchmarks for the RAG backend.
+
+Everything runs against local stand-ins: a generated website on a local HTTP
+server, a fake Groq-compatible completion server and (by default) the hashing
+stub embedder, so no network access or model download is needed.
+
+    python -m benchmarks.run --scenarios crawler_ingest,ingest,retrieve,chat
+"""
+import os, time, json, random, pickle, asyncio, logging, argparse, tempfile, sqlite3, threading
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.common import summarize, environment, write_results, use_stub_embedder, use_stub_reranker, serve_in_thread, free_port
+from benchmarks.site import make_site, WORDS
+from benchmarks.fake_llm import FakeLLMServer
+
+SCENARIOS = ('crawler_ingest', 'ingest', 'retrieve', 'chat', 'rerank', 'async_chat', 'admission', 'bulk_ingest', 'shards')
+
+def bench_crawler_ingest(args, ctx):
+    from ingest import crawler_ingest
+    start = time.perf_counter()
+    docs = crawler_ingest(ctx['site_url'] + '/index.html', max_pages=args.pages, max_depth=args.depth, delay=0)
+    elapsed = time.perf_counter() - start
+    text_bytes = sum(len(d['text']) for d in docs)
+    return {
+        'pages': len(docs),
+        'seconds': elapsed,
+        'pages_per_second': len(docs) / elapsed if elapsed else None,
+        'text_bytes': text_bytes,
+    }
+
+def bench_ingest(args, ctx):
+    import app as backend
+    client = backend.app.test_client()
+    start = time.perf_counter()
+    resp = client.post('/ingest', json={'url': ctx['site_url'] + '/index.html', 'max_pages': args.pages, 'depth': args.depth})
+    elapsed = time.perf_counter() - start
+    body = resp.get_json() or {}
+    ingested = body.get('ingested', 0)
+    return {
+        'status': resp.status_code,
+        'crawled': body.get('crawled'),
+        'ingested': ingested,
+        'seconds': elapsed,
+        'pages_per_second': body.get('crawled', ingested) / elapsed if elapsed else None,
+        'bytes_avoided': body.get('bytes_avoided'),
+        'embeddings_avoided': body.get('embeddings_avoided'),
+    }
+
+def bench_bulk_ingest(args, ctx):
+    """bulk_ingest.py over the generated site's HTML files, per parse worker count."""
+    import bulk_ingest
+    out = {}
+    for workers in args.bulk_workers:
+        db_path = os.path.join(ctx['tmpdir'], f'bulk-{workers}.db')
+        result = bulk_ingest.bulk_ingest(db_path, [('html_dir', ctx['site_dir'])], base_url=ctx['site_url'],
+                                         workers=workers, batch_size=args.bulk_batch_size, log=lambda line: None)
+        out[str(workers)] = result
+    return out
+
+def _populate(db_path, n_docs, n_collections=1, seed=0):
+    # writes rows directly so corpus setup does not pay for an index rebuild
+    import rag
+    rng = random.Random(seed)
+    rag.init_db(db_path)
+    conn = sqlite3.connect(db_path)
+    rows = []
+    for i in range(n_docs):
+        content = ' '.join(rng.choice(WORDS) for _ in range(120))
+        collection = f'site{i % n_collections}.bench.local'
+        rows.append((f'http://{collection}/doc/{i}', content, pickle.dumps(rag.compute_embedding(content)),
+                     time.time(), collection))
+    conn.executemany('INSERT OR REPLACE INTO docs (url, content, embedding, created_at, collection) VALUES (?,?,?,?,?)', rows)
+    conn.commit()
+    conn.close()
+
+def bench_retrieve(args, ctx):
+    import rag
+    rng = random.Random(1)
+    out = {}
+    for size in args.corpus_sizes:
+        db_path = os.path.join(ctx['tmpdir'], f'retrieve_{size}.db')
+        _populate(db_path, size, n_collections=args.collections)
+        start = time.perf_counter()
+        rag.rebuild_index(db_path)
+        rebuild = time.perf_counter() - start
+        # 'scoped' searches a single collection's partition, as /chat does with a collection filter
+        latencies = {'all': [], 'scoped': []}
+        for _ in range(args.queries):
+            query = ' '.join(rng.choice(WORDS) for _ in range(8))
+            for scope, collections in (('all', None), ('scoped', ['site0.bench.local'])):
+                t0 = time.perf_counter()
+                rag.retrieve(db_path, query, top_k=args.top_k, collections=collections)
+                latencies[scope].append(time.perf_counter() - t0)
+        out[str(size)] = {
+            'rebuild_seconds': rebuild,
+            'latency': summarize(latencies['all']),
+            'scoped_latency': summarize(latencies['scoped']),
+        }
+    return out
+
+def bench_shards(args, ctx):
+    """retrieve latency per shard count, resharding one corpus with the rebalance tool."""
+    import rag, shards
+    rng = random.Random(6)
+    queries = [' '.join(rng.choice(WORDS) for _ in range(8)) for _ in range(args.queries)]
+    out = {}
+    for size in args.corpus_sizes:
+        db_path = os.path.join(ctx['tmpdir'], f'shards_{size}.db')
+        _populate(db_path, size, n_collections=args.collections)
+        out[str(size)] = {}
+        for n in args.shard_counts:
+            if rag.shard_pool is not None:
+                rag.shard_pool.close()
+                rag.shard_pool = None
+            rebalance = shards.rebalance(db_path, n)
+            start = time.perf_counter()
+            rag.load_index(db_path)
+            load = time.perf_counter() - start
+            latencies = []
+            for query in queries:
+                t0 = time.perf_counter()
+                rag.retrieve(db_path, query, top_k=args.top_k)
+                latencies.append(time.perf_counter() - t0)
+            out[str(size)][str(n)] = {'rebalance_seconds': rebalance['seconds'], 'index_load_seconds': load,
+                                      'latency': summarize(latencies)}
+        if rag.shard_pool is not None:
+            rag.shard_pool.close()
+            rag.shard_pool = None
+    return out
+
+def _chat_load(base_url, concurrency, total, rng):
+    import requests
+    local = threading.local()
+    questions = [' '.join(rng.choice(WORDS) for _ in range(8)) + '?' for _ in range(total)]
+
+    def one(i):
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+        t0 = time.perf_counter()
+        r = session.post(f'{base_url}/chat', json={'session_id': f'bench-{i % concurrency}', 'message': questions[i]}, timeout=120)
+        return time.perf_counter() - t0, r.status_code
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(one, range(total)))
+    wall = time.perf_counter() - start
+    latencies = [l for l, status in results if status == 200]
+    return {
+        'concurrency': concurrency,
+        'requests': total,
+        'errors': sum(1 for _, status in results if status != 200),
+        'seconds': wall,
+        'requests_per_second': len(latencies) / wall if wall else None,
+        'latency': summarize(latencies),
+    }
+
+def bench_chat(args, ctx):
+    import app as backend
+    import rag
+    from werkzeug.serving import make_server
+    rag.rebuild_index(backend.DB_PATH)
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, backend.app, threaded=True)
+    base_url = serve_in_thread(server)
+    rng = random.Random(2)
+    try:
+        return {str(c): _chat_load(base_url, c, max(c * args.requests_per_client, c), rng) for c in args.concurrency}
+    finally:
+        server.shutdown()
+
+def bench_rerank(args, ctx):
+    """Chat latency and prompt size: plain top-k vs. over-fetch + rerank to a smaller top-k."""
+    import rag, rerank
+    if args.reranker == 'stub':
+        use_stub_reranker(pair_ms=args.rerank_pair_ms)
+    else:
+        os.environ['RAG_RERANK_BACKEND'] = args.reranker
+        rerank.load_reranker(block=True)
+    db_path = os.path.join(ctx['tmpdir'], 'rerank.db')
+    _populate(db_path, args.rerank_corpus)
+    rag.rebuild_index(db_path)
+    llm = ctx['llm']
+    rng = random.Random(3)
+    questions = [' '.join(rng.choice(WORDS) for _ in range(8)) + '?' for _ in range(args.rerank_questions)]
+    variants = {
+        'baseline': {'top_k': args.top_k * 2, 'use_rerank': False},
+        'rerank': {'top_k': args.rerank_top_k, 'use_rerank': True},
+    }
+    out = {}
+    for name, params in variants.items():
+        latencies = []
+        served = len(llm.prompt_chars)
+        for q in questions:
+            t0 = time.perf_counter()
+            rag.chat_with_retrieval(db_path, f'bench-{name}', q, **params)
+            latencies.append(time.perf_counter() - t0)
+        prompts = llm.prompt_chars[served:]
+        out[name] = dict(params, latency=summarize(latencies),
+                         mean_prompt_chars=sum(prompts) / len(prompts) if prompts else None)
+    base, rr = out['baseline']['latency'], out['rerank']['latency']
+    out['p50_change_pct'] = (rr['p50_ms'] - base['p50_ms']) / base['p50_ms'] * 100
+    out['candidates'] = rerank.RERANK_CANDIDATES
+    return out
+
+async def _sustained_load(base_url, concurrency, seconds, rng):
+    """`concurrency` clients posting /chat back to back for `seconds`."""
+    import httpx
+    questions = [' '.join(rng.choice(WORDS) for _ in range(8)) + '?' for _ in range(256)]
+    latencies, errors = [], 0
+    deadline = time.perf_counter() + seconds
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(limits=limits, timeout=120) as client:
+        async def worker(n):
+            nonlocal errors
+            i = n
+            while time.perf_counter() < deadline:
+                t0 = time.perf_counter()
+                try:
+                    r = await client.post(f'{base_url}/chat', json={'session_id': f'load-{n}', 'message': questions[i % len(questions)]})
+                    ok = r.status_code == 200
+                except httpx.HTTPError:
+                    ok = False
+                if ok:
+                    latencies.append(time.perf_counter() - t0)
+                else:
+                    errors += 1
+                i += concurrency
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(n) for n in range(concurrency)))
+        wall = time.perf_counter() - start
+    return {
+        'concurrency': concurrency,
+        'seconds': wall,
+        'completed': len(latencies),
+        'errors': errors,
+        'chats_per_second': len(latencies) / wall if wall else None,
+        'latency': summarize(latencies),
+    }
+
+def _start_uvicorn(app):
+    import uvicorn
+    port = free_port()
+    server = uvicorn.Server(uvicorn.Config(app, host='127.0.0.1', port=port, log_level='warning'))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server, f'http://127.0.0.1:{port}'
+
+def bench_async_chat(args, ctx):
+    """Sustained concurrent /chat on the ASGI app vs. the threaded Flask dev server, one process."""
+    import app as backend
+    import rag, asgi
+    from werkzeug.serving import make_server
+    rag.rebuild_index(backend.DB_PATH)
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    rng = random.Random(4)
+    out = {}
+    server, base_url = _start_uvicorn(asgi.app)
+    try:
+        out['asgi'] = {str(c): asyncio.run(_sustained_load(base_url, c, args.load_seconds, rng)) for c in args.async_concurrency}
+    finally:
+        server.should_exit = True
+    wsgi = make_server('127.0.0.1', 0, backend.app, threaded=True)
+    wsgi_url = serve_in_thread(wsgi)
+    try:
+        out['wsgi_threaded'] = {str(c): asyncio.run(_sustained_load(wsgi_url, c, args.load_seconds, rng)) for c in args.async_concurrency}
+    finally:
+        wsgi.shutdown()
+    return out
+
+def bench_admission(args, ctx):
+    """Chat latency during an ingest burst, with the admission gate vs. unbounded; coalescing of identical questions."""
+    import app as backend
+    import rag, admission, requests
+    from collections import Counter
+    from werkzeug.serving import make_server
+    rag.rebuild_index(backend.DB_PATH)
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    server = make_server('127.0.0.1', 0, backend.app, threaded=True)
+    base_url = serve_in_thread(server)
+    gate = admission.gate
+    bounded = (gate.slots, dict(gate.limits))
+    rng = random.Random(5)
+    out = {}
+
+    def ingest(name):
+        r = requests.post(f'{base_url}/ingest', json={'url': ctx['site_url'], 'max_pages': args.pages,
+                                                      'depth': args.depth, 'collection': name}, timeout=600)
+        return r.status_code
+
+    try:
+        for mode in ('unbounded', 'admission'):
+            if mode == 'unbounded':
+                gate.slots, gate.limits = 10 ** 6, {kind: 10 ** 6 for kind in gate.limits}
+            else:
+                gate.slots, gate.limits = bounded[0], dict(bounded[1])
+            with ThreadPoolExecutor(max_workers=args.burst_ingests) as pool:
+                ingests = [pool.submit(ingest, f'burst-{mode}-{i}') for i in range(args.burst_ingests)]
+                time.sleep(0.2)
+                chat = _chat_load(base_url, args.concurrency[0], args.concurrency[0] * args.requests_per_client, rng)
+                statuses = Counter(str(f.result()) for f in ingests)
+            out[mode] = {'chat': chat, 'ingest_status': dict(statuses)}
+        served = ctx['llm'].requests_served
+        with ThreadPoolExecutor(max_workers=args.coalesce_burst) as pool:
+            statuses = list(pool.map(lambda i: requests.post(f'{base_url}/chat', json={
+                'session_id': f'coalesce-{i}', 'message': 'What does the site say about pricing?'}, timeout=120).status_code,
+                range(args.coalesce_burst)))
+        out['coalescing'] = {'identical_requests': len(statuses), 'ok': statuses.count(200),
+                             'llm_calls': ctx['llm'].requests_served - served}
+    finally:
+        gate.slots, gate.limits = bounded[0], dict(bounded[1])
+        server.shutdown()
+    return out
+
+BENCHMARKS = {
+    'crawler_ingest': bench_crawler_ingest,
+    'ingest': bench_ingest,
+    'retrieve': bench_retrieve,
+    'chat': bench_chat,
+    'rerank': bench_rerank,
+    'async_chat': bench_async_chat,
+    'admission': bench_admission,
+    'bulk_ingest': bench_bulk_ingest,
+    'shards': bench_shards,
+}
+
+def _int_list(value):
+    return [int(v) for v in value.split(',') if v]
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS))
+    parser.add_argument('--embedder', default='stub', help="'stub' or a rag.EMBED_BACKENDS name")
+    parser.add_argument('--pages', type=int, default=100)
+    parser.add_argument('--depth', type=int, default=10)
+    parser.add_argument('--duplicate-ratio', type=float, default=0.1, help='share of site pages that are near-duplicates')
+    parser.add_argument('--corpus-sizes', type=_int_list, default=[100, 1000, 5000])
+    parser.add_argument('--collections', type=int, default=10, help='collections the retrieve corpus is split into')
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--top-k', type=int, default=4)
+    parser.add_argument('--concurrency', type=_int_list, default=[1, 8, 32])
+    parser.add_argument('--requests-per-client', type=int, default=5)
+    parser.add_argument('--async-concurrency', type=_int_list, default=[64, 256])
+    parser.add_argument('--load-seconds', type=float, default=10.0)
+    parser.add_argument('--burst-ingests', type=int, default=6, help='concurrent ingests during the admission scenario')
+    parser.add_argument('--coalesce-burst', type=int, default=16, help='identical concurrent questions')
+    parser.add_argument('--bulk-workers', type=_int_list, default=[1, 4], help='parse processes for bulk_ingest')
+    parser.add_argument('--bulk-batch-size', type=int, default=500)
+    parser.add_argument('--shard-counts', type=_int_list, default=[1, 2, 4])
+    parser.add_argument('--reranker', default='stub', help="'stub' or a rerank.RERANK_BACKENDS name")
+    parser.add_argument('--rerank-pair-ms', type=float, default=0.5, help='stub cross-encoder cost per pair')
+    parser.add_argument('--rerank-top-k', type=int, default=3)
+    parser.add_argument('--rerank-corpus', type=int, default=2000)
+    parser.add_argument('--rerank-questions', type=int, default=50)
+    parser.add_argument('--llm-latency-ms', type=float, default=200.0)
+    parser.add_argument('--llm-ms-per-1k-chars', type=float, default=2.0)
+    parser.add_argument('--output', default=os.path.join(os.path.dirname(__file__), 'results', 'latest.json'))
+    args = parser.parse_args(argv)
+    scenarios = [s for s in args.scenarios.split(',') if s]
+    unknown = set(scenarios) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f'unknown scenarios: {sorted(unknown)}')
+
+    tmp = tempfile.TemporaryDirectory(prefix='rag-bench-')
+    # app.py initializes the store at import, so the environment has to be set first
+    os.environ['RAG_DB_PATH'] = os.path.join(tmp.name, 'bench.db')
+    os.environ['RAG_CRAWL_DELAY'] = '0'
+    # bench clients reuse session ids far faster than a person would; the admission scenario sets its own
+    os.environ['RAG_SESSION_RATE'] = '0'
+    os.environ.pop('HUGGINGFACE_API_KEY', None)
+    if args.embedder == 'stub':
+        use_stub_embedder()
+    else:
+        os.environ['RAG_EMBED_BACKEND'] = args.embedder
+
+    site_dir, site_server = make_site(pages=args.pages, duplicate_ratio=args.duplicate_ratio)
+    llm_server = FakeLLMServer(('127.0.0.1', 0), args.llm_latency_ms, args.llm_ms_per_1k_chars)
+    ctx = {'tmpdir': tmp.name, 'site_dir': site_dir.name, 'site_url': serve_in_thread(site_server), 'llm': llm_server}
+    os.environ['GROQ_BASE_URL'] = serve_in_thread(llm_server)
+    os.environ['GROQ_API_KEY'] = 'fake-key'
+
+    import app as backend
+    if not backend.rag.ready.wait(timeout=600) or backend.rag.init_error is not None:
+        raise SystemExit(f'backend failed to initialize: {backend.rag.init_error}')
+
+    results = {'environment': environment(), 'parameters': vars(args), 'scenarios': {}}
+    try:
+        for name in scenarios:
+            print(f'running {name} ...', flush=True)
+            results['scenarios'][name] = BENCHMARKS[name](args, ctx)
+            print(json.dumps(results['scenarios'][name], indent=2), flush=True)
+    finally:
+        site_server.shutdown()
+        llm_server.shutdown()
+        site_dir.cleanup()
+        tmp.cleanup()
+    write_results(results, args.output)
+    print(f'wrote {args.output}')
+    return results
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,58 @@
+"""Synthetic multi-page website generator served from a local HTTP server."""
+import os, random, tempfile, functools
+from http.server import ThreadingHTTPServer, SimpleHTTPRequestHandler
+
+WORDS = ('alpha beta gamma delta epsilon zeta eta theta iota kappa lambda mu nu xi omicron pi rho '
+         'sigma tau upsilon phi chi psi omega vector index crawl embed query answer source page '
+         'document retrieval latency throughput cache shard model token prompt context store').split()
+
+NAV = '<nav><a href="index.html">Home</a> <a href="page_1.html">Docs</a> <a href="page_2.html">Blog</a></nav>'
+FOOTER = '<footer>Copyright Example Corp. All rights reserved. Privacy policy. Terms of service.</footer>'
+
+def _paragraph(rng, words):
+    return ' '.join(rng.choice(WORDS) for _ in range(words)).capitalize() + '.'
+
+def generate_site(root, pages=100, paragraphs=8, words_per_paragraph=60, links_per_page=5, duplicate_ratio=0.0, seed=0):
+    """Write `pages` linked HTML files into root (index.html + page_N.html) and return the paths.
+
+    Every page shares the same nav and footer. duplicate_ratio of the pages copy an
+    earlier page's body and links with one word changed, to exercise near-duplicate detection.
+    """
+    rng = random.Random(seed)
+    names = ['index.html'] + [f'page_{i}.html' for i in range(1, pages)]
+    pages_seen = []
+    for i, name in enumerate(names):
+        # a chain link keeps every page reachable; the rest fan out randomly
+        targets = {names[(i + 1) % pages]}
+        if pages_seen and rng.random() < duplicate_ratio:
+            # same page under another URL: body and links copied, one word changed
+            source_body, source_targets = rng.choice(pages_seen)
+            words = source_body.split(' ')
+            words[rng.randrange(len(words))] = rng.choice(WORDS)
+            body = ' '.join(words)
+            targets.update(source_targets)
+        else:
+            targets.update(rng.choice(names) for _ in range(links_per_page - 1))
+            body = '\n'.join(f'<p>{_paragraph(rng, words_per_paragraph)}</p>' for _ in range(paragraphs))
+        pages_seen.append((body, targets))
+        links = ' '.join(f'<a href="{t}">{t}</a>' for t in sorted(targets))
+        html = (f'<html><head><title>Page {i}</title><style>p {{margin: 0}}</style></head><body>'
+                f'{NAV}<h1>Page {i}</h1>{body}<div class="links">{links}</div>{FOOTER}</body></html>')
+        with open(os.path.join(root, name), 'w') as f:
+            f.write(html)
+    return [os.path.join(root, n) for n in names]
+
+class _QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+def serve_site(root, host='127.0.0.1', port=0):
+    """Return an (unstarted) ThreadingHTTPServer serving files from root."""
+    handler = functools.partial(_QuietHandler, directory=root)
+    return ThreadingHTTPServer((host, port), handler)
+
+def make_site(pages=100, **kwargs):
+    """Generate a site in a fresh temp directory; returns (tempdir, server)."""
+    tmp = tempfile.TemporaryDirectory(prefix='rag-bench-site-')
+    generate_site(tmp.name, pages=pages, **kwargs)
+    return tmp, serve_site(tmp.name)
@@ -0,0 +1,77 @@
+"""Cold-start benchmark: how long until the backend can bind, and until it is ready.
+
+Each measurement runs in a fresh interpreter so import caches do not hide the cost.
+
+    python -m benchmarks.startup --docs 5000
+"""
+import os, sys, json, time, argparse, tempfile, subprocess
+
+from benchmarks.common import ROOT, environment, write_results, use_stub_embedder
+
+def _child(mode, db_path, embedder):
+    """Runs inside the measured interpreter and prints a JSON timing breakdown."""
+    timings = {}
+    t0 = time.perf_counter()
+    sys.path.insert(0, os.path.join(ROOT, 'backend'))
+    if mode == 'app':
+        os.environ['RAG_DB_PATH'] = db_path
+        if embedder == 'stub':
+            use_stub_embedder()
+        start = time.perf_counter()
+        import app
+        timings['app_import_seconds'] = time.perf_counter() - start
+        app.rag.ready.wait()
+        timings['app_ready_seconds'] = time.perf_counter() - start
+        return timings
+    start = time.perf_counter()
+    import rag
+    timings['rag_import_seconds'] = time.perf_counter() - start
+    if embedder == 'stub':
+        use_stub_embedder()
+    else:
+        os.environ['RAG_EMBED_BACKEND'] = embedder
+    start = time.perf_counter()
+    rag.load_model()
+    timings['model_load_seconds'] = time.perf_counter() - start
+    snapshot = os.path.isdir(rag.index_snapshot_dir(db_path))
+    start = time.perf_counter()
+    rag.load_index(db_path)
+    key = 'index_load_snapshot_seconds' if snapshot else 'index_load_rebuild_seconds'
+    timings[key] = time.perf_counter() - start
+    timings['total_seconds'] = time.perf_counter() - t0
+    return timings
+
+def _run_child(mode, db_path, embedder):
+    code = ('import json, sys; sys.path.insert(0, %r); from benchmarks.startup import _child; '
+            'print(json.dumps(_child(%r, %r, %r)))' % (ROOT, mode, db_path, embedder))
+    out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--docs', type=int, default=5000)
+    parser.add_argument('--embedder', default='stub')
+    parser.add_argument('--output', default=os.path.join(os.path.dirname(__file__), 'results', 'startup.json'))
+    args = parser.parse_args(argv)
+
+    with tempfile.TemporaryDirectory(prefix='rag-bench-startup-') as tmp:
+        db_path = os.path.join(tmp, 'startup.db')
+        # populate with the stub so the corpus does not depend on the embedder under test
+        use_stub_embedder()
+        import rag
+        from benchmarks.run import _populate
+        rag.init_db(db_path)
+        rag.load_model()
+        _populate(db_path, args.docs)
+
+        results = {'environment': environment(), 'parameters': vars(args)}
+        # first run has no snapshot and rebuilds the index (writing the snapshot)
+        results['cold_rebuild'] = _run_child('rag', db_path, args.embedder)
+        results['cold_snapshot'] = _run_child('rag', db_path, args.embedder)
+        results['app'] = _run_child('app', db_path, args.embedder)
+    print(json.dumps(results, indent=2))
+    write_results(results, args.output)
+    return results
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+"""Stand-ins for the embedding and reranking models so benchmarks run without model downloads."""
+import re, time, hashlib
+import numpy as np
+
+TOKEN_RE = re.compile(r'\w+')
+
+class StubEmbedder:
+    """Deterministic hashing-trick embedder with the SentenceTransformer encode() signature.
+
+    Vectors are bag-of-words hashes, so texts sharing words still land near each
+    other and retrieval results are meaningful enough to exercise the index.
+    """
+
+    def __init__(self, dim=384):
+        self.dim = dim
+
+    def _encode_one(self, text):
+        vec = np.zeros(self.dim, dtype='float32')
+        for token in TOKEN_RE.findall(text.lower()):
+            h = int.from_bytes(hashlib.blake2b(token.encode(), digest_size=8).digest(), 'little')
+            vec[h % self.dim] += 1.0 if (h >> 32) & 1 else -1.0
+        return vec
+
+    def encode(self, texts, normalize_embeddings=False, batch_size=32, **kwargs):
+        single = isinstance(texts, str)
+        mat = np.vstack([self._encode_one(t) for t in ([texts] if single else texts)])
+        if normalize_embeddings:
+            norms = np.linalg.norm(mat, axis=1, keepdims=True)
+            mat = mat / np.where(norms == 0, 1, norms)
+        return mat[0] if single else mat
+
+class StubCrossEncoder:
+    """Token-overlap scorer with the CrossEncoder predict() signature.
+
+    pair_ms adds a fixed cost per scored pair so the rerank latency budget can be exercised.
+    """
+
+    def __init__(self, pair_ms=0.5):
+        self.pair_ms = pair_ms
+
+    def predict(self, pairs, batch_size=32, **kwargs):
+        if self.pair_ms:
+            time.sleep(self.pair_ms * len(pairs) / 1000.0)
+        scores = []
+        for query, doc in pairs:
+            q = set(TOKEN_RE.findall(query.lower()))
+            d = TOKEN_RE.findall(doc.lower())
+            scores.append(sum(1 for t in d if t in q) / (len(d) or 1))
+        return np.array(scores, dtype='float32')
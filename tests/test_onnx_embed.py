@@ -0,0 +1,75 @@
+"""Parity of the ONNX Runtime embedding backends with sentence-transformers.
+
+Both backends must produce vectors that can share an index built by
+sentence-transformers. Skips unless torch, sentence-transformers and onnxruntime
+are installed and the model weights are in the local Hugging Face cache (loading
+the model once, e.g. by starting the backend, puts them there). The first run
+exports the model under RAG_ONNX_DIR.
+
+    python -m pytest tests/test_onnx_embed.py -s
+"""
+import os, sys, time
+import numpy as np
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (ROOT, os.path.join(ROOT, 'backend')):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+pytest.importorskip('torch')
+pytest.importorskip('transformers')
+pytest.importorskip('onnxruntime')
+sentence_transformers = pytest.importorskip('sentence_transformers')
+
+from benchmarks.embedders import synthetic_texts, embedding_parity
+import rag
+
+TEXTS = 256
+QUERIES = 64
+K = 10
+# backend -> (min cosine, mean cosine, nearest-neighbour overlap@K) to the reference
+THRESHOLDS = {
+    'onnx': (0.999, 0.9995, 0.95),
+    'onnx-int8': (0.95, 0.98, 0.7),
+}
+
+def _throughput(embedder, texts):
+    embedder.encode(texts[:8], normalize_embeddings=True)
+    start = time.perf_counter()
+    embs = embedder.encode(texts, normalize_embeddings=True, batch_size=64)
+    return np.asarray(embs, dtype='float32'), len(texts) / (time.perf_counter() - start)
+
+@pytest.fixture(scope='module')
+def texts():
+    return synthetic_texts(TEXTS)
+
+@pytest.fixture(scope='module')
+def reference(texts):
+    # cached weights only, so an offline machine skips at once instead of retrying downloads
+    try:
+        model = sentence_transformers.SentenceTransformer(rag.MODEL_NAME, local_files_only=True)
+    except Exception as e:
+        pytest.skip(f'{rag.MODEL_NAME} weights not cached: {e}')
+    embs, rate = _throughput(model, texts)
+    print(f'\nsentence-transformers: {rate:.1f} texts/s')
+    return embs
+
+@pytest.mark.parametrize('backend', sorted(THRESHOLDS))
+def test_backend_matches_sentence_transformers(backend, texts, reference):
+    embs, rate = _throughput(rag.load_embedder(backend), texts)
+    assert embs.shape == reference.shape == (TEXTS, rag.EMBED_DIM)
+    parity = embedding_parity(reference, embs, QUERIES, K)
+    print(f"\n{backend}: min cosine {parity['min_cosine']:.5f}, mean cosine {parity['mean_cosine']:.5f}, "
+          f"neighbour overlap@{K} {parity[f'neighbour_overlap_at_{K}']:.3f}, {rate:.1f} texts/s")
+    min_cosine, mean_cosine, overlap = THRESHOLDS[backend]
+    assert parity['min_cosine'] >= min_cosine
+    assert parity['mean_cosine'] >= mean_cosine
+    assert parity[f'neighbour_overlap_at_{K}'] >= overlap
+
+def test_single_text_and_empty_batch(reference):
+    embedder = rag.load_embedder('onnx')
+    single = embedder.encode('an example sentence', normalize_embeddings=True)
+    assert single.shape == (rag.EMBED_DIM,)
+    assert np.isclose(np.linalg.norm(single), 1.0, atol=1e-5)
+    assert embedder.encode([], normalize_embeddings=True).shape == (0, rag.EMBED_DIM)